@@ -2,15 +2,22 @@
 
 # ######################## Imports
 import sys
+import os
 import math
-import pyglet  # INSTALL
-import pyglet.gl
-from pyglet.window import key
-from queue import Queue, PriorityQueue  # ,LifoQueue
+import mmap
+import json
+import argparse
+import atexit
+import multiprocessing
+from queue import Queue  # ,LifoQueue
+from array import array
+from collections import deque, OrderedDict
+from itertools import chain, islice
 import random
 from timeit import default_timer as timer
 
-import cProfile
+# pyglet, cProfile and numpy are imported when needed, see initGUI,
+# runProfile and the batch heuristics
 
 
 # ######################## Globals
@@ -18,6 +25,7 @@ import cProfile
 # will be initialized elsewhere
 searches = []
 curSearch = None
+planSearch = None  # search of the shown solution, see movePuzzle
 heuristics = []
 curHeur = None
 keys = {}
@@ -26,25 +34,47 @@ keys = {}
 flag_debug = False
 flag_profile = False
 flag_hint = False
-
-# Performance Data
-heuristic_calls = 0
+flag_cache = True  # look up and store solutions, see getSolutionCache
+
+# Performance Data, see class Metrics
+metrics = None
+
+# Korf's 100 15-puzzle instances, part of the benchmark boards
+korffile = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'korf100.txt')
+
+# Lookup tables (pattern databases) are built once and cached here
+cachedir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache')
+move_tables = {}  # see moveTable
+heuristic_contexts = {}  # see heuristicContext
+conflict_budget = 1 << 16  # max. number of contents in one conflict table
+pattern_databases = {}
+pattern_budget = 1 << 24  # max. number of states for building one table
+pattern_minimum = 4  # min. number of tiles in one group
+distance_layers = {}  # see distanceLayers
+distance_budget = 1 << 18  # max. number of boards for exact distances
+walking_distances = {}  # see getWalkingDistance
+walking_budget = 1 << 18  # max. number of line states for one table
+perimeters = {}  # see getPerimeter
+perimeter_depth = 14  # depth of the perimeter for perimeter searches
+perimeter_budget = 1 << 20  # max. number of boards in one perimeter
+replan_depth = 6  # max. length of a detour to a known plan, see replanMoves
+replan_window = 1000  # moves of a plan known at once, see Puzzle.move
+tt_budget = 64  # MiB for the transposition table of IDA* (TT)
+solution_cache = None
+solution_version = 2  # of cache entries, older ones aren't trusted optimal
 
 # ui
 font_large = 32
 font_small = 11
 font_tile = 20
 
-window = pyglet.window.Window(resizable=True, caption='15-Puzzle')
-maxdimension = min(window.width, window.height)
-
-try:
-    bgimg = pyglet.resource.image('dodge.png')
-except Exception:
-    print("No dodge found")
-    bgimg = None
-
-pyglet.gl.glClearColor(0.1, 0.1, 0.1, 1)
+# will be initialized in initGUI
+window = None
+maxdimension = 0
+bgimg = None
+background = None  # the running BackgroundSearch
+panel = None  # the labels of the window, see Panel
 
 
 # ######################## Puzzle logic
@@ -81,16 +111,19 @@ class Puzzle(object):
                 text = text + ' ' + ['→', '↑', '↓', '←'][int(element)]
         print(text)
 
-    # Run heuristic
+    # Run heuristic (its value is kept until the board changes)
     def heuristic(self, _heuristic=curHeur):
-        return _heuristic.run(self.state(), self.dim)
+        if _heuristic.name not in self.costs:
+            self.costs[_heuristic.name] = _heuristic.run(self.state(),
+                                                         self.dim)
+        return self.costs[_heuristic.name]
 
     # Update hint
     def calchint(self):
         if not self.solved:
-            if self.solution is not '':
+            if self.solution != '':
                 hints = ['→', '↑', '↓', '←']
-                if puzzle.twisted:
+                if self.twisted:
                     hints.reverse()
                 self.hint = hints[int(self.solution[0])]
             else:
@@ -102,6 +135,8 @@ class Puzzle(object):
     # Set the game to solved state
     def reset(self):
         self.board = self.initcopy()
+        self.costs = {}
+        self.replanned = False
 
         self.solved = True
         self.solvable = True
@@ -113,6 +148,7 @@ class Puzzle(object):
             self.update(solution[1], _sol=solution[0])
         elif isinstance(solution, str):
             self.solution = solution
+            self.plans = None  # see move
         else:
             raise(ValueError("The solution in solve() must be str or tuple"))
 
@@ -131,9 +167,8 @@ class Puzzle(object):
 
             move = self.solution[0]
             rest = self.solution[1:]
-            self.update(getNeighborStates(
-                                self.board,
-                                self.dim)[int(move)], _sol=rest)
+            self.update(moveBoard(self.board, int(move), self.dim),
+                        _sol=rest)
 
         if self.solution == '':
             if not self.solved:
@@ -158,7 +193,8 @@ class Puzzle(object):
 
     # Set the game state and check for solvability
     def update(self, newfield, _paritycheck=True, _sol=''):
-        self.board = newfield[:]
+        self.board = getBoard(newfield, self.dim)[:]
+        self.costs = {}
         if _paritycheck:
             self.checkparity()
         self.checksolved()
@@ -166,88 +202,93 @@ class Puzzle(object):
         self.solve(_sol)
 
     # Randomize puzzle (with a heuristic bound)
+    #
+    # Candidates are drawn in chunks (see randomBoards). With a bound, they
+    # are rated at once (see Heuristic.runBatch) and the first one below the
+    # bound is taken, the best one else.
     def random(self, _bound=0, _heuristic=None):
         iter_max = 10000
+        chunk = 1000
         if _bound <= 0:
-            iter_max = 1
+            iter_max = chunk = 1
 
         min_heur = 2147483647
         min_board = None
 
-        for i in range(iter_max):
-            board = self.boardcopy()
-            self.solvable = False
-            while not self.solvable:
-                random.shuffle(board)
-                self.update(board)
-
-            heur = _heuristic.run(self.state(), self.dim)
-            if heur < min_heur:
-                min_heur = heur
-                min_board = board
-                if heur < _bound:
-                    break
+        for i in range(0, iter_max, chunk):
+            boards = randomBoards(self.dim, chunk)
+            if _bound <= 0:
+                break
+            for board, heur in zip(boards,
+                                   _heuristic.runBatch(boards, self.dim)):
+                if heur < min_heur:
+                    min_heur = heur
+                    min_board = board
+                    if heur < _bound:
+                        break
+            if min_heur < _bound:
+                break
 
-        self.update(min_board)
+        if min_board is None:
+            min_board = boards[0]
+        self.update([int(tile) for tile in min_board])
 
     # Is the puzzle solved?
     def checksolved(self):
         self.solved = self.board == self.initcopy()
 
-    # Is the puzzle solvable?
+    # Is the puzzle solvable? (see isSolvable)
     def checkparity(self):
-        inversions = 0
-        for num in self.board:
-            if num == 0:
-                continue
-            for other in self.board:
-                if other == 0:
-                    continue
-
-                numpos = self.board.index(num)
-                otherpos = self.board.index(other)
-                if (numpos < otherpos) and (other < num):
-                    inversions += 1
-
-        if (self.dim[0] % 2) != 0:
-            self.solvable = (inversions % 2) == 0
-        else:
-            if ((self.dim[1] - self.index(0)[1]) % 2) != 0:
-                self.solvable = (inversions % 2) == 0
-            else:
-                self.solvable = (inversions % 2) != 0
-
+        self.solvable = isSolvable(self.board, self.dim)
         return None
 
     # Swap the empty tile with neighbor
     def move(self, direction):
-        neighbors = list(getNeighborStates(self.board, self.dim))
-
         if self.twisted:
             direction = [0, 1, 2, 3][::-1][direction]
 
-        new = neighbors[direction]
+        new = moveBoard(self.board, direction, self.dim)
 
         if new is None:
             if flag_debug:
                 print("This move is not possible (" + str(direction) + ")")
             return None
 
+        # off the solution (or the solved board): replan from the boards
+        # along it (see replanMoves), the plan may be longer than needed.
+        # Only the next replan_window moves are known at once, the boards
+        # beyond are added when the player gets there.
+        plans = self.plans
+        self.replanned = False
         if self.solution != '' and str(direction) == self.solution[0]:
             self.update(new, _paritycheck=False, _sol=self.solution[1:])
+        elif self.solution != '' or self.solved:
+            if plans is None or packState(self.board, self.dim) not in plans:
+                plans = planBoards(self.board, self.dim, self.solution,
+                                   replan_window)
+            plan = replanMoves(new, self.dim, plans)
+            self.replanned = len(plan) > max(len(self.solution) - 1, 1)
+            self.update(new, _paritycheck=False, _sol=plan)
         else:
             self.update(new, _paritycheck=False)
+        self.plans = plans
 
         return None
 
-    # Run a search on puzzle
-    def search(self, searchObject, heuristicObject,
-               _debug=False, _profile=False):
-        start = self.boardcopy()
-        goal = self.initcopy()
+    # Return the solution of the cache for a search (or None)
+    def cached(self, searchObject, heuristicObject):
+        cache = getSolutionCache()
+        if cache is None:
+            return None
+        entry = cache.lookup(self.board, self.dim, searchObject,
+                             heuristicObject)
+        if entry is None:
+            return None
 
-        return searchObject.run(start, goal, self.dim,
-                                heuristicObject, _debug, _profile)
+        print("\nSolution from cache (" + entry['search'] + ", " +
+              entry['heuristic'] + "), " + str(len(entry['solution'])) +
+              " steps.")
+        return (entry['solution'], self.boardcopy())
 
     # Return a state with no solution
     def state(self):
@@ -258,25 +299,178 @@ class Puzzle(object):
 
 class Heuristic(object):
 
-    # Initialize with name and function
-    def __init__(self, name, function):
+    # Initialize with name, function and (optional) incremental evaluator
+    # and batch function (see hBatchManhattan). _factor scales the values
+    # of evaluator and batch function, see LinearConflictEvaluator. _files
+    # (dim) lists the files of the lookup tables the heuristic needs.
+    # _admissible if the heuristic never overestimates the moves left (only
+    # then optimal searches give optimal solutions).
+    def __init__(self, name, function, _evaluator=None, _factor=1,
+                 _batch=None, _files=None, _admissible=True):
         self.name = name
         self.function = function
+        self.evaluatorclass = _evaluator
+        self.factor = _factor
+        self.batch = _batch
+        self.files = _files
+        self.admissible = _admissible
         return None
 
     # Calc heuristic cost
     def run(self, state, dim):
         return self.function(state, dim)
 
+    # Calc heuristic costs of many boards (2-D array, a board per row).
+    # Without batch function or numpy, the boards are rated one by one.
+    def runBatch(self, boards, dim):
+        if self.batch is not None:
+            try:
+                costs = self.batch(boards, dim)
+            except ImportError:
+                pass  # no numpy
+            else:
+                if self.factor != 1:
+                    costs = (costs * self.factor).astype(int)
+                return costs
+        return [self.function(('', list(board)), dim) for board in boards]
+
+    # Return a new evaluator (for searches), see Evaluator for _goal
+    def evaluator(self, dim, _goal=None):
+        if self.evaluatorclass is None:
+            return Evaluator(self, dim, _goal)
+        return self.evaluatorclass(self, dim, _goal)
+
+
+# ######################## Search metrics
+
+# The Metrics object holds the numbers of the running (or last) search.
+# Searches count in its attributes and call progress() when expanded
+# reaches due, which calls the hooks registered with addProgressHook.
+# Without hooks due is infinite, so a search only pays for a comparison.
+class Metrics(object):
+
+    def __init__(self):
+        self.hooks = []  # [function, interval, next call]
+        self.reset()
+
+        return None
+
+    # Start counting for a new search
+    def reset(self):
+        self.expanded = 0
+        self.generated = 0
+        self.pruned = 0  # generated but never expanded (duplicates, bound)
+        self.heuristic_calls = 0
+        self.frontier = 0
+        self.peak_frontier = 0  # most nodes kept at once (depth first: path)
+        self.bound = None  # current lower bound of the solution length
+        self.iterations = []  # (bound, seconds, expanded nodes) for IDA
+        self.workers = {}  # nodes expanded per worker process (parallel IDA)
+        self.suboptimality = None  # proven factor (anytime searches)
+        self.tstart = timer()
+
+        for hook in self.hooks:
+            hook[2] = hook[1]
+        self.schedule()
+
+    # Set due to the next call of a hook
+    def schedule(self):
+        self.due = min([hook[2] for hook in self.hooks], default=math.inf)
+
+    # Call the hooks that are due
+    def progress(self):
+        for hook in self.hooks[:]:
+            if self.expanded >= hook[2]:
+                hook[2] = (self.expanded // hook[1] + 1) * hook[1]
+                hook[0](self)
+        self.schedule()
+
+    # Note the end of an IDA iteration (the weight for ARA*)
+    def iteration(self, bound):
+        self.iterations.append((bound, self.elapsed(), self.expanded))
+
+    # Seconds since the search started
+    def elapsed(self):
+        return timer() - self.tstart
+
+    # Approximate memory use: the peak of this process in KiB (or None)
+    def memory(self):
+        try:
+            import resource
+        except ImportError:
+            return None
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Return the numbers as dict (for JSON). The memory is the peak of the
+    # whole process so far, not of this search (unless it has a process of
+    # its own, see benchmarkChild).
+    def asdict(self):
+        numbers = {'expanded': self.expanded,
+                   'generated': self.generated,
+                   'pruned': self.pruned,
+                   'heuristic_calls': self.heuristic_calls,
+                   'peak_frontier': self.peak_frontier,
+                   'process_peak_memory': self.memory()}
+        if self.iterations:
+            numbers['iterations'] = [
+                {'bound': bound, 'time': elapsed, 'expanded': expanded}
+                for bound, elapsed, expanded in self.iterations]
+        if self.workers:
+            numbers['workers'] = list(self.workers.values())
+        if self.suboptimality is not None:
+            numbers['suboptimality'] = self.suboptimality
+        return numbers
+
+
+metrics = Metrics()
+
+
+# Call function(metrics) every interval expanded nodes of a search (in
+# this process). Hooks may raise SearchStopped to end the search.
+def addProgressHook(function, _interval=10000):
+    metrics.hooks.append([function, _interval,
+                          (metrics.expanded // _interval + 1) * _interval])
+    metrics.schedule()
+
+
+def removeProgressHook(function):
+    metrics.hooks = [hook for hook in metrics.hooks if hook[0] != function]
+    metrics.schedule()
+
+
+# Stop every search after seconds (checked every 1000 expanded nodes)
+def addTimeLimit(seconds):
+    def stop(metrics):
+        if metrics.elapsed() > seconds:
+            raise SearchStopped("time limit exceeded")
+    addProgressHook(stop, 1000)
+
+
+# Progress hook for debugging, prints a line
+def printProgress(metrics):
+    print("Expanded: " + str(metrics.expanded) +
+          " | Generated: " + str(metrics.generated) +
+          " | Pruned: " + str(metrics.pruned) +
+          " | Frontier: " + str(metrics.frontier) +
+          " (max. " + str(metrics.peak_frontier) + ")" +
+          " | Bound: " + str(metrics.bound) +
+          " | " + "{:.2f}s".format(metrics.elapsed()))
+
 
 # ######################## Search class
 
 class Search(object):
 
-    # Initialize with name and data structure
-    def __init__(self, name, _frontier=None):
+    # Initialize with name and data structure (or search function),
+    # _optimal if the solutions are optimal with an admissible heuristic,
+    # _bounded if the memory of the search doesn't grow with its frontier
+    def __init__(self, name, _frontier=None, _function=None, _optimal=True,
+                 _bounded=False):
         self.name = name
         self.frontier = _frontier
+        self.function = _function
+        self.optimal = _optimal
+        self.bounded = _bounded
 
         return None
 
@@ -295,69 +489,147 @@ class Search(object):
         if _profile:
             solution = self.runProfile(start, goal, dim, _heuristic, _debug)
         else:
-            heurf = _heuristic.function
-            frontier = self.frontier
-
-            tstart = timer()
-
-            if frontier is None:  # this is an ID search
-                solution = idaSearch(start, goal, heurf, _debug=_debug)
-                solution = (solution[0], solution[-1])
-            else:                  # this is a normal search
-                solution = genericSearch(start, goal, heurf,
-                                         frontier, _debug=_debug)
-
-            tend = timer()
-            elapsed_time = tend - tstart
+            solution = self.execute(start, goal, dim, _heuristic, _debug)
 
-            print("\n" + self.name + " is complete." +
-                  "\n    It took " + str(elapsed_time) + "s." +
-                  "\n    Solution has " + str(len(solution[0])) + " steps.")
+        print("\n" + self.name + " is complete." +
+              "\n    It took " + str(metrics.elapsed()) + "s." +
+              "\n    Solution has " + str(len(solution[0])) + " steps." +
+              "\n    Expanded " + str(metrics.expanded) + ", generated " +
+              str(metrics.generated) + ", pruned " + str(metrics.pruned) +
+              " nodes.")
+        if _debug:
+            for bound, elapsed, expanded in metrics.iterations:
+                print("    Iteration " + str(bound) + " done in " +
+                      str(elapsed) + "s (cumulated), " + str(expanded) +
+                      " nodes")
 
         return solution
 
+    # Run this search without any output (unless _debug, see printProgress)
+    def execute(self, start, goal, dim, heuristic, _debug=False):
+        if _debug:
+            addProgressHook(printProgress)
+        try:
+            if self.function is not None:
+                return self.function(start, goal, dim, heuristic)
+            elif self.frontier is None:  # this is an ID search
+                solution = idaSearch(start, goal, dim, heuristic)
+                return (solution[0], solution[-1])
+            else:                        # this is a normal search
+                return genericSearch(start, goal, dim, heuristic,
+                                     self.frontier)
+        finally:
+            if _debug:
+                removeProgressHook(printProgress)
+
     # Run search with cProfile
     def runProfile(self, start, goal, dim, heuristic, debug):
-        heurf = heuristic.function
-        frontier = self.frontier
-        solution = ('', [])
+        import cProfile
 
         ref = [None]  # cProfile: need to pass a mutable object
-        if frontier is None:      # this is an ID search
-            cProfile.runctx('ref[0] = idaSearch(start, goal, heurf, debug)',
-                            globals(), locals())
-            solution = (ref[0][0], ref[0][-1])
-        else:              # this is a normal search
-            cProfile.runctx('ref[0] = genericSearch(start, goal, heurf,' +
-                            'frontier, debug)', globals(), locals())
-            solution = ref[0]
+        cProfile.runctx('ref[0] = self.execute(start, goal, dim, ' +
+                        'heuristic, debug)', globals(), locals())
+        return ref[0]
 
-        print("\n" + self.name + " is complete." +
-              "\n    Solution has " + str(len(solution[0])) + " steps.")
 
-        return solution
+# ######################## Heuristic functions
 
+# The tables of the built-in heuristics for one dimension (and goal board,
+# by default the solved one): for a tile at an index, the flat tables
+# manhattan, toorac and misplaced at [tile * cells + index] hold its costs
+# (0 for the empty tile), goalrow and goalcol its goal row and column.
+#
+# Linear conflicts are looked up by the content of every row and column in
+# the tables rowconflicts and colconflicts (a dict per line), filled when a
+# content is first seen (up to conflict_budget contents per line).
+class HeuristicContext(object):
+
+    # Initialize with dimension of game and (optional) goal board
+    def __init__(self, dim, _goal=None):
+        self.dim = dim
+        self.cells = cells = dim[0] * dim[1]
+
+        if _goal is None:
+            self.goal = [cells - 1] + list(range(cells - 1))
+        else:
+            self.goal = [0] * cells
+            for i, tile in enumerate(_goal):
+                self.goal[tile] = i
+        self.goalrow = [self.goal[tile] // dim[0] for tile in range(cells)]
+        self.goalcol = [self.goal[tile] % dim[0] for tile in range(cells)]
+
+        self.manhattan = [0] * (cells * cells)
+        self.toorac = [0] * (cells * cells)
+        self.misplaced = [0] * (cells * cells)
+        for tile in range(1, cells):
+            goalrow, goalcol = self.goalrow[tile], self.goalcol[tile]
+            for index in range(cells):
+                row, col = divmod(index, dim[0])
+                self.manhattan[tile * cells + index] = \
+                    abs(goalrow - row) + abs(goalcol - col)
+                self.toorac[tile * cells + index] = \
+                    (goalrow != row) + (goalcol != col)
+                self.misplaced[tile * cells + index] = \
+                    int(self.goal[tile] != index)
+
+        self.rowconflicts = [{} for row in range(dim[1])]
+        self.colconflicts = [{} for col in range(dim[0])]
+
+        return None
+
+    # Sum a flat table over the tiles of a board
+    def sum(self, table, board):
+        cells = self.cells
+        return sum([table[tile * cells + i] for i, tile in enumerate(board)])
+
+    # Linear conflicts of a board: 2 for every pair of tiles in their goal
+    # row (or column) in the wrong order
+    def conflicts(self, board):
+        width = self.dim[0]
+        cost = 0
+        for row, table in enumerate(self.rowconflicts):
+            line = tuple(board[row * width:(row + 1) * width])
+            conflicts = table.get(line)
+            if conflicts is None:
+                conflicts = self.lineConflicts(line, self.goalrow, row,
+                                               self.goalcol)
+                if len(table) < conflict_budget:
+                    table[line] = conflicts
+            cost += conflicts
+        for col, table in enumerate(self.colconflicts):
+            line = tuple(board[col::width])
+            conflicts = table.get(line)
+            if conflicts is None:
+                conflicts = self.lineConflicts(line, self.goalcol, col,
+                                               self.goalrow)
+                if len(table) < conflict_budget:
+                    table[line] = conflicts
+            cost += conflicts
+        return cost
+
+    # Conflicts of the tiles of a line: only tiles whose goal line (by
+    # goalline) is this one count, their order is given by goalplace
+    def lineConflicts(self, line, goalline, index, goalplace):
+        places = [goalplace[tile] for tile in line
+                  if tile != 0 and goalline[tile] == index]
+        return 2 * sum(1 for i, place in enumerate(places)
+                       for other in places[i + 1:] if other < place)
+
+
+# Get the heuristic context of the solved board of a dimension
+def heuristicContext(dim):
+    if dim not in heuristic_contexts:
+        heuristic_contexts[dim] = HeuristicContext(dim)
+    return heuristic_contexts[dim]
 
-# ######################## Heuristic functions
 
 # highly used function!
 #
 # for a given path, calc the heuristic costs
 # heuristic function: Toorac = tiles out of row and column
 def hCostToorac(path, dim, _oldheur=0):
-    state = path[-1]
-    cost = 0
-    for row in range(dim[1]):
-        for col in range(dim[0]):
-            num = state[row * dim[0] + col]
-            if num is 0:
-                continue
-            should_row, should_col = divmod((num-1), dim[0])
-            if row != should_row:
-                cost += 1
-            if col != should_col:
-                cost += 1
-    return cost
+    context = heuristicContext(dim)
+    return context.sum(context.toorac, getBoard(path[-1], dim))
 
 
 # highly used function!
@@ -365,13 +637,8 @@ def hCostToorac(path, dim, _oldheur=0):
 # for a given path, calc the heuristic costs
 # heuristic funktion: Mpt = Misplaced Tiles
 def hCostMpt(path, dim, _oldheur=0):
-    state = path[-1]
-    cost = 0
-    for i, num in enumerate(state):
-        exp = i + 1
-        if exp != num and exp != 16:
-            cost += 1
-    return cost
+    context = heuristicContext(dim)
+    return context.sum(context.misplaced, getBoard(path[-1], dim))
 
 
 # highly used function!
@@ -379,60 +646,8 @@ def hCostMpt(path, dim, _oldheur=0):
 # for a given path, calc the heuristic costs
 # heuristic funktion: Manhattan Distance
 def hCostManhattan(path, dim, _oldheur=0):
-    state = path[-1]
-    if _oldheur == 0 or len(path[0]) == 0:
-        cost = 0
-        for row in range(dim[1]):
-            for col in range(dim[0]):
-                num = state[row * dim[0] + col]
-                if num is 0:
-                    continue
-                should_row, should_col = divmod(num-1, dim[0])
-
-                if should_row > row:
-                    cost += should_row - row
-                else:
-                    cost += row - should_row
-
-                if should_col > col:
-                    cost += should_col - col
-                else:
-                    cost += col - should_col
-        return cost
-    lastmove = int(path[0][-1])
-    izero = state.index(0)
-
-    swap_was_row, swap_was_col = divmod(izero, dim[0])
-    swap_is_row = swap_was_row
-    swap_is_col = swap_was_col
-
-    if lastmove == 0:  # left
-        iswap = izero + 1
-        swap_is_col += 1
-
-    elif lastmove == 1:  # up
-        iswap = izero - dim[0]
-        swap_is_row -= 1
-
-    elif lastmove == 2:  # down
-        iswap = izero + dim[0]
-        swap_is_row += 1
-
-    elif lastmove == 3:  # right
-        iswap = izero - 1
-        swap_is_col -= 1
-
-    swap = state[iswap]
-
-    swap_should_row, swap_should_col = divmod(swap-1, dim[0])
-
-    swap_was_impact = abs(swap_should_row - swap_was_row) +\
-        abs(swap_should_col - swap_was_col)
-    swap_is_impact = abs(swap_should_row - swap_is_row) +\
-        abs(swap_should_col - swap_is_col)
-
-    cost = _oldheur - swap_was_impact + swap_is_impact
-    return cost
+    context = heuristicContext(dim)
+    return context.sum(context.manhattan, getBoard(path[-1], dim))
 
 
 # highly used function!
@@ -440,45 +655,9 @@ def hCostManhattan(path, dim, _oldheur=0):
 # for a given path, calc the heuristic costs
 # heuristic funktion: LC = Linear Conflicts
 def hCostLinearConflict(path, dim, _oldheur=0):
-    state = path[-1]
-    cost = 0
-
-    for row in range(dim[1]):
-        rowtimesdimzero = row * dim[0]
-        for col in range(dim[0]):
-            index = rowtimesdimzero + col
-            num = state[index]
-            if num == 0:
-                continue
-            should_row, should_col = divmod(num - 1, dim[0])
-            if should_col == col:  # col num should
-                for i in range(row):
-                    pre = state[index - (i+1) * dim[0]]
-                    if pre < num:
-                        continue  # pre != 0 is checked implicitly
-                    if (pre-1) % dim[0] != col:
-                        continue  # col pre should
-                    cost += 2
-
-            if should_row == row:  # row num should
-                for x in range(rowtimesdimzero, index):
-                    pre = state[x]
-                    if pre < num:
-                        continue  # pre != 0 is checked implicitly
-                    if (pre-1) // dim[0] != row:
-                        continue  # row pre should
-                    cost += 2
-
-            if should_row > row:
-                cost += should_row - row
-            else:
-                cost += row - should_row
-
-            if should_col > col:
-                cost += should_col - col
-            else:
-                cost += col - should_col
-    return cost
+    context = heuristicContext(dim)
+    state = getBoard(path[-1], dim)
+    return context.sum(context.manhattan, state) + context.conflicts(state)
 
 
 # highly used function!
@@ -513,6 +692,24 @@ def hCostLC1_1x(path, dim, _oldheur=0):
     return int(hCostLinearConflict(path, dim) * 1.1)
 
 
+# highly used function!
+#
+# for a given path, calc the heuristic costs
+# heuristic function: WD = Walking Distance
+def hCostWalking(path, dim, _oldheur=0):
+    rows, cols = getWalkingDistance(dim)
+    rowkey, colkey = walkingKeys(getBoard(path[-1], dim), dim)
+    return rows.table[rowkey] + cols.table[colkey]
+
+
+# highly used function!
+#
+# for a given path, calc the heuristic costs
+# heuristic function: PDB = disjoint additive pattern databases
+def hCostPattern(path, dim, _oldheur=0):
+    return getPatternDatabase(dim).lookup(getBoard(path[-1], dim))
+
+
 # highly used function!
 #
 # for a element give coords (in state)
@@ -521,255 +718,1959 @@ def getStatePosition(state, dim, element):
     return divmod(index, dim[0])
 
 
+# ######################## Batch heuristics
+
+# The batch functions rate many boards at once with numpy: boards is a
+# 2-D array with a board per row, the result an array of costs.
+
+# Sum a flat table of the heuristic context (see HeuristicContext) over the
+# tiles of every board
+def sumPositionTable(boards, dim, table):
+    import numpy  # INSTALL
+
+    cells = dim[0] * dim[1]
+    table = numpy.asarray(table, dtype=numpy.int32).reshape(cells, cells)
+    boards = numpy.asarray(boards)
+    return table[boards, numpy.arange(cells)].sum(axis=1)
+
+
+def hBatchMpt(boards, dim):
+    return sumPositionTable(boards, dim, heuristicContext(dim).misplaced)
+
+
+def hBatchToorac(boards, dim):
+    return sumPositionTable(boards, dim, heuristicContext(dim).toorac)
+
+
+def hBatchManhattan(boards, dim):
+    return sumPositionTable(boards, dim, heuristicContext(dim).manhattan)
+
+
+# Manhattan distance plus 2 for every pair of tiles in their goal row (or
+# column) in the wrong order, like hCostLinearConflict
+def hBatchLinearConflict(boards, dim):
+    import numpy  # INSTALL
+
+    boards = numpy.asarray(boards)
+    cost = hBatchManhattan(boards, dim)
+
+    tile = numpy.arange(dim[0] * dim[1])
+    goalrow = numpy.where(tile > 0, (tile - 1) // dim[0], -1)
+    goalcol = numpy.where(tile > 0, (tile - 1) % dim[0], -1)
+    grid = boards.reshape(len(boards), dim[1], dim[0])
+
+    # lines: (boards, line, place in line), the goal line of their tiles
+    for lines, goalline in ((grid, goalrow),
+                            (grid.transpose(0, 2, 1), goalcol)):
+        length = lines.shape[2]
+        home = goalline[lines] == numpy.arange(lines.shape[1])[:, None]
+        before = numpy.triu(numpy.ones((length, length), dtype=bool), 1)
+        conflicts = (home[:, :, :, None] & home[:, :, None, :] &
+                     (lines[:, :, :, None] > lines[:, :, None, :]) & before)
+        cost += 2 * conflicts.sum(axis=(1, 2, 3))
+    return cost
+
+
+# ######################## Pattern databases
+
+# Write a file (of cachedir) by write(f), other processes never see it
+# half written
+def replaceFile(filename, write, _binary=False):
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    tmpname = filename + '.' + str(os.getpid())
+    with open(tmpname, 'wb' if _binary else 'w') as f:
+        write(f)
+    os.replace(tmpname, filename)
+
+
+# Objects of class PatternDatabase hold disjoint additive pattern tables
+# for one dimension. Every group of tiles has a table of its own, indexed
+# by the positions of the group's tiles. Only moves of the group's tiles
+# are counted, so the values of all groups may be added up. An entry is the
+# minimum over all positions of the empty tile, so the values are
+# admissible but not consistent: a single move may change them by more
+# than 1 (up to 5 on 4x4). Searches must not take the first path to a state
+# as the shortest one, see genericSearch.
+class PatternDatabase(object):
+
+    # Initialize with dimension of game and the groups of tiles
+    def __init__(self, dim, groups):
+        self.dim = dim
+        self.groups = [tuple(group) for group in groups]
+
+        cells = dim[0] * dim[1]
+        self.weights = [[cells ** i for i in range(len(group))]
+                        for group in self.groups]
+        self.tables = []
+
+        return None
+
+    # Name of the file a group's table is stored in
+    def filename(self, group):
+        return os.path.join(cachedir, 'pdb-{}x{}-{}.bin'.format(
+            self.dim[0], self.dim[1], '-'.join(str(t) for t in group)))
+
+    # Memory-map all tables, build the missing ones first
+    def load(self):
+        self.tables = []
+        for group in self.groups:
+            filename = self.filename(group)
+            if not os.path.exists(filename):
+                self.save(filename, self.build(group))
+            with open(filename, 'rb') as f:
+                self.tables.append(
+                    mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    # Write a table (see replaceFile)
+    def save(self, filename, table):
+        replaceFile(filename, lambda f: f.write(table), _binary=True)
+
+    # Build the table of a group by a retrograde BFS from the goal
+    #
+    # A state of the BFS is the position of the blank plus the positions
+    # of the group's tiles. Moving the blank onto another tile is free,
+    # moving it onto a tile of the group costs 1 (0-1 BFS with a deque).
+    def build(self, group):
+        print("Building pattern database " + os.path.basename(
+            self.filename(group)) + " ...", file=sys.stderr)
+        tstart = timer()
+
+        dimx, dimy = self.dim
+        cells = dimx * dimy
+        size = len(group)
+
+        neighbors = []
+        for i in range(cells):
+            row, col = divmod(i, dimx)
+            neighbors.append(
+                [i + d for d, ok in ((-1, col > 0), (1, col < dimx - 1),
+                                     (-dimx, row > 0), (dimx, row < dimy - 1))
+                 if ok])
+
+        # state = blank + cells * (pos_0 + cells * pos_1 + ...)
+        weights = [cells ** (i + 1) for i in range(size)]
+        goal = cells - 1 + sum((t - 1) * w for t, w in zip(group, weights))
+
+        dist = bytearray(b'\xff') * (cells ** (size + 1))
+        table = bytearray(b'\xff') * (cells ** size)
+        dist[goal] = 0
+        table[goal // cells] = 0
+        queue = deque([goal])
+
+        while queue:
+            state = queue.popleft()
+            cost = dist[state]
+            rest, blank = divmod(state, cells)
+            positions = []
+            for i in range(size):
+                rest, pos = divmod(rest, cells)
+                positions.append(pos)
+
+            for i in neighbors[blank]:
+                if i in positions:
+                    new = state + (blank - i) * weights[positions.index(i)] +\
+                        i - blank
+                    if cost + 1 < dist[new]:
+                        dist[new] = cost + 1
+                        queue.append(new)
+                        if cost + 1 < table[new // cells]:
+                            table[new // cells] = cost + 1
+                else:
+                    new = state + i - blank
+                    if cost < dist[new]:
+                        dist[new] = cost
+                        queue.appendleft(new)
+
+        print("    done in " + str(timer() - tstart) + "s.",
+              file=sys.stderr)
+        return table
+
+    # Sum up the table entries of all groups
+    def lookup(self, state):
+        where = [0] * len(state)
+        for i, tile in enumerate(state):
+            where[tile] = i
+
+        cost = 0
+        for table, group, weights in zip(self.tables, self.groups,
+                                         self.weights):
+            index = 0
+            for tile, weight in zip(group, weights):
+                index += where[tile] * weight
+            cost += table[index]
+        return cost
+
+
+# Split the tiles into groups as big as the build budget allows
+# (5-5-5 for 4x4, 6-2 for 3x3). Beyond 5x5 the groups get too small to
+# be of use, while there are ever more tables to build.
+def patternGroups(dim):
+    cells = dim[0] * dim[1]
+    size = 1
+    while size < cells - 1 and cells ** (size + 2) <= pattern_budget:
+        size += 1
+    if size < min(pattern_minimum, cells - 1):
+        raise ValueError("The pattern database groups for {}x{} would be "
+                         "too small ({})".format(dim[0], dim[1], size))
+    tiles = list(range(1, cells))
+    return [tiles[i:i + size] for i in range(0, len(tiles), size)]
+
+
+# Return the files of the pattern database of a dimension
+def patternFiles(dim):
+    database = PatternDatabase(dim, patternGroups(dim))
+    return [database.filename(group) for group in database.groups]
+
+
+# Return the (memory-mapped) pattern database of a dimension
+def getPatternDatabase(dim):
+    if dim not in pattern_databases:
+        database = PatternDatabase(dim, patternGroups(dim))
+        database.load()
+        pattern_databases[dim] = database
+    return pattern_databases[dim]
+
+
+# ######################## Walking distance
+
+# Objects of class WalkingDistance hold the walking distance table (by
+# Ken'ichiro Takahashi) for lines of one length. Only the lines of the
+# tiles count: a line state is how many tiles of every goal line are in
+# every line, and the line of the empty tile. A move across the lines
+# carries one tile to the empty tile's line, moves along the lines don't
+# change the line state. The table holds the number of moves to the goal
+# for every line state, so rows and columns of a board add up.
+#
+# Line states are keyed by an int: the tiles of goal line g in line l
+# count in the digit l * lines + g (base length + 1), the line of the
+# empty tile in the digit above. A move changes a key by a sum of weights.
+class WalkingDistance(object):
+
+    # Initialize with number and length of the lines
+    def __init__(self, lines, length):
+        self.lines = lines
+        self.length = length
+
+        base = length + 1
+        self.weights = [[base ** (line * lines + goal)
+                         for goal in range(lines)] for line in range(lines)]
+        self.blankweight = base ** (lines * lines)
+        self.table = {}
+
+        return None
+
+    # Name of the file the table is stored in
+    def filename(self):
+        return os.path.join(cachedir, 'wd-{}x{}.json'.format(self.lines,
+                                                             self.length))
+
+    # Read the table, build it first if missing
+    def load(self):
+        filename = self.filename()
+        if not os.path.exists(filename):
+            self.save(filename, self.build())
+        with open(filename) as f:
+            stored = json.load(f)
+        self.table = dict(zip(stored['keys'], stored['distances']))
+
+    # Write the table (see replaceFile)
+    def save(self, filename, table):
+        replaceFile(filename, lambda f: json.dump(
+            {'keys': list(table), 'distances': list(table.values())}, f))
+
+    # Key of the line state with tiles given as (line, goal line) pairs
+    def key(self, tiles, blank):
+        return sum(self.weights[line][goal] for line, goal in tiles) +\
+            blank * self.blankweight
+
+    # Number of line states (all but those of 1-wide boards can be
+    # reached), counted up to beyond budget: for every line of the empty
+    # tile, the ways to spread the tiles of all goal lines over the lines
+    # (matrices with these row and column sums)
+    def states(self, budget):
+        memo = {}
+
+        # rows: tiles per line, still to spread; cols: tiles per goal line
+        # not spread yet (sorted, the order of goal lines doesn't matter)
+        def count(rows, cols):
+            if len(rows) == 1:
+                return 1  # the last line takes what is left
+            if (rows, cols) not in memo:
+                total = 0
+                for row in spread(rows[0], cols):
+                    total += count(rows[1:], tuple(sorted(
+                        col - n for col, n in zip(cols, row))))
+                    if total > budget:
+                        break
+                memo[rows, cols] = total
+            return memo[rows, cols]
+
+        # the ways to take tiles from the goal lines for one line
+        def spread(tiles, cols):
+            if len(cols) == 1:
+                if tiles <= cols[0]:
+                    yield (tiles,)
+                return
+            for n in range(min(tiles, cols[0]), -1, -1):
+                for rest in spread(tiles - n, cols[1:]):
+                    yield (n,) + rest
+
+        cols = tuple(sorted([self.length] * (self.lines - 1) +
+                            [self.length - 1]))
+        total = 0
+        for blank in range(self.lines):
+            total += count(tuple(self.length - (line == blank)
+                                 for line in range(self.lines)), cols)
+            if total > budget:
+                break
+        return total
+
+    # Build the table by a BFS from the goal (every line full of its own
+    # tiles, the empty tile in the last line)
+    def build(self):
+        if self.states(walking_budget) > walking_budget:
+            raise ValueError("The walking distance table for lines " +
+                             "of {} is too large".format(self.length))
+        print("Building walking distance table " +
+              os.path.basename(self.filename()) + " ...", file=sys.stderr)
+        tstart = timer()
+
+        lines, base = self.lines, self.length + 1
+        goal = self.key([(line, line) for line in range(lines)
+                         for i in range(self.length)][:-1], lines - 1)
+        table = {goal: 0}
+        queue = deque([goal])
+
+        while queue:
+            key = queue.popleft()
+            cost = table[key] + 1
+            blank, rest = divmod(key, self.blankweight)
+            counts = []
+            for i in range(lines * lines):
+                rest, count = divmod(rest, base)
+                counts.append(count)
+
+            for line in (blank - 1, blank + 1):
+                if not 0 <= line < lines:
+                    continue
+                for goal in range(lines):
+                    if counts[line * lines + goal] == 0:
+                        continue
+                    new = key - self.weights[line][goal] +\
+                        self.weights[blank][goal] +\
+                        (line - blank) * self.blankweight
+                    if new not in table:
+                        table[new] = cost
+                        queue.append(new)
+
+        print("    done in " + str(timer() - tstart) + "s.",
+              file=sys.stderr)
+        return table
+
+
+# Return the (row, column) walking distance tables of a dimension
+def getWalkingDistance(dim):
+    tables = []
+    for lines, length in ((dim[1], dim[0]), (dim[0], dim[1])):
+        if (lines, length) not in walking_distances:
+            table = WalkingDistance(lines, length)
+            table.load()
+            walking_distances[lines, length] = table
+        tables.append(walking_distances[lines, length])
+    return tables
+
+
+# Return the files of the (row, column) walking distance tables
+def walkingFiles(dim):
+    return [WalkingDistance(lines, length).filename()
+            for lines, length in ((dim[1], dim[0]), (dim[0], dim[1]))]
+
+
+# Return the (row, column) keys of a board, see WalkingDistance
+def walkingKeys(board, dim):
+    rows, cols = getWalkingDistance(dim)
+    tiles = [divmod(i, dim[0]) + divmod(tile - 1, dim[0])
+             for i, tile in enumerate(board) if tile != 0]
+    izero = board.index(0)
+    return (rows.key([(row, goalrow) for row, col, goalrow, goalcol in tiles],
+                     izero // dim[0]),
+            cols.key([(col, goalcol) for row, col, goalrow, goalcol in tiles],
+                     izero % dim[0]))
+
+
+# ######################## Goal perimeter
+
+# Objects of class Perimeter hold every board within depth moves of the
+# solved board, each with the moves from there to the solved board (a
+# str, so its length is the distance). They are found by a BFS from the
+# solved board and stored in the cache directory per dimension and depth.
+class Perimeter(object):
+
+    # Initialize with dimension of game and depth
+    def __init__(self, dim, depth):
+        self.dim = dim
+        self.depth = depth
+        self.paths = {}  # packed state -> moves to the solved board
+
+        return None
+
+    # Name of the file the perimeter is stored in
+    def filename(self):
+        return os.path.join(cachedir, 'perimeter-{}x{}-{}.json'.format(
+            self.dim[0], self.dim[1], self.depth))
+
+    # Read the perimeter, build it first if missing
+    def load(self):
+        filename = self.filename()
+        if not os.path.exists(filename):
+            self.save(filename, self.build())
+        with open(filename) as f:
+            stored = json.load(f)
+        self.paths = dict(zip(stored['states'], stored['paths']))
+
+    # Write the perimeter (see replaceFile)
+    def save(self, filename, paths):
+        replaceFile(filename, lambda f: json.dump(
+            {'states': list(paths), 'paths': list(paths.values())}, f))
+
+    # Build the perimeter by a BFS from the solved board, a move from a
+    # board of the last layer is taken back on the way to the goal
+    def build(self):
+        print("Building perimeter " + os.path.basename(self.filename()) +
+              " ...", file=sys.stderr)
+        tstart = timer()
+
+        bits = stateBits(self.dim)
+        table = moveTable(self.dim)
+        goal = Puzzle(*self.dim).initcopy()
+        layer = [(packState(goal, self.dim), goal.index(0))]
+        paths = {layer[0][0]: ''}
+
+        for depth in range(self.depth):
+            successors = []
+            for state, izero in layer:
+                for move, new, iswap, tile in packedChildren(state, izero, -1,
+                                                             table, bits):
+                    if new not in paths:
+                        paths[new] = str(3 - move) + paths[state]
+                        successors.append((new, iswap))
+            layer = successors
+            if len(paths) > perimeter_budget:
+                raise ValueError("The perimeter of depth {} is too large "
+                                 "for {}x{} boards".format(self.depth,
+                                                           *self.dim))
+
+        print("    done in " + str(timer() - tstart) + "s.",
+              file=sys.stderr)
+        return paths
+
+
+# Return the perimeter of a dimension and depth
+def getPerimeter(dim, depth):
+    if (dim, depth) not in perimeters:
+        perimeter = Perimeter(dim, depth)
+        perimeter.load()
+        perimeters[dim, depth] = perimeter
+    return perimeters[dim, depth]
+
+
+# ######################## Heuristic evaluators
+
+# Evaluators update a heuristic value from the parent's value and the move
+# just made instead of running the heuristic function on the whole board.
+# A raw value is whatever an evaluator needs for that, value() turns it
+# into the heuristic cost. Moves are given as the packed parent state, the
+# moved tile, its old (src) and new (dst) index.
+#
+# Searches keeping their own nodes (A*) use start() and child(), depth first
+# searches use reset(), apply() and undo() to follow their path.
+#
+# Evaluators with targets = True estimate the distance to any _goal board,
+# not only to the solved one (backward searches need this).
+class Evaluator(object):
+
+    targets = False
+
+    # Initialize with heuristic, dimension of game and (optional) goal board
+    def __init__(self, heuristic, dim, _goal=None):
+        if _goal is not None and not self.targets:
+            raise ValueError(heuristic.name + " can only estimate the " +
+                             "distance to the solved board")
+        self.heuristic = heuristic
+        self.dim = dim
+        self.bits = stateBits(dim)
+        self.mask = (1 << self.bits) - 1
+
+        self.row = [i // dim[0] for i in range(dim[0] * dim[1])]
+        self.col = [i % dim[0] for i in range(dim[0] * dim[1])]
+        self.target = _goal
+        if _goal is None:
+            self.context = heuristicContext(dim)
+        else:
+            self.context = HeuristicContext(dim, _goal)
+        self.goal = self.context.goal
+
+        self.raw = None
+        self.stack = []
+
+        return None
+
+    # Raw value of a packed state
+    def start(self, state):
+        return self.heuristic.function(('', state), self.dim)
+
+    # Raw value after a move (fallback: from scratch)
+    def child(self, raw, state, tile, src, dst):
+        return self.start(state ^ (tile << (src * self.bits)) |
+                          (tile << (dst * self.bits)))
+
+    # Heuristic cost of a raw value
+    def value(self, raw):
+        return raw
+
+    # Set the evaluator to the given packed state
+    def reset(self, state):
+        self.raw = self.start(state)
+        self.stack = []
+        return self.value(self.raw)
+
+    # Make a move, return the new heuristic cost
+    def apply(self, state, tile, src, dst):
+        self.stack.append(self.raw)
+        self.raw = self.child(self.raw, state, tile, src, dst)
+        return self.value(self.raw)
+
+    # Take back the last move, return the old heuristic cost
+    def undo(self):
+        self.raw = self.stack.pop()
+        return self.value(self.raw)
+
+
+# Misplaced tiles, tiles out of row and column and Manhattan distance: only
+# the costs of the moved tile change, table is one of the heuristic context
+class TableEvaluator(Evaluator):
+
+    targets = True
+    table = None
+
+    def __init__(self, heuristic, dim, _goal=None):
+        Evaluator.__init__(self, heuristic, dim, _goal)
+        self.costs = getattr(self.context, self.table)
+        self.cells = dim[0] * dim[1]
+
+    def start(self, state):
+        return self.context.sum(self.costs, unpackState(state, self.dim))
+
+    def child(self, raw, state, tile, src, dst):
+        base = tile * self.cells
+        return raw + self.costs[base + dst] - self.costs[base + src]
+
+
+class MptEvaluator(TableEvaluator):
+
+    table = 'misplaced'
+
+
+class TooracEvaluator(TableEvaluator):
+
+    table = 'toorac'
+
+
+class ManhattanEvaluator(TableEvaluator):
+
+    table = 'manhattan'
+
+
+# Linear conflicts (and its multiples, by the heuristic's factor)
+#
+# A move keeps the tile's order within the line it moves along, so only the
+# conflicts of the moved tile in the line it leaves and the line it enters
+# change. Only those two lines are scanned.
+class LinearConflictEvaluator(ManhattanEvaluator):
+
+    def __init__(self, heuristic, dim, _goal=None):
+        ManhattanEvaluator.__init__(self, heuristic, dim, _goal)
+        self.factor = heuristic.factor
+
+    def start(self, state):
+        return ManhattanEvaluator.start(self, state) +\
+            self.context.conflicts(unpackState(state, self.dim))
+
+    def child(self, raw, state, tile, src, dst):
+        raw = ManhattanEvaluator.child(self, raw, state, tile, src, dst)
+        if self.row[src] == self.row[dst]:  # moved along its row
+            return raw + self.colConflicts(state, tile, dst) -\
+                self.colConflicts(state, tile, src)
+        return raw + self.rowConflicts(state, tile, dst) -\
+            self.rowConflicts(state, tile, src)
+
+    # Conflicts of tile (placed at index) with the tiles of its column
+    def colConflicts(self, state, tile, index):
+        col = self.col[index]
+        if self.col[self.goal[tile]] != col:
+            return 0
+        cost = 0
+        for i in range(col, self.dim[0] * self.dim[1], self.dim[0]):
+            other = (state >> (i * self.bits)) & self.mask
+            if i == index or other == 0 or self.col[self.goal[other]] != col:
+                continue
+            if (i < index) == (self.goal[other] > self.goal[tile]):
+                cost += 2
+        return cost
+
+    # Conflicts of tile (placed at index) with the tiles of its row
+    def rowConflicts(self, state, tile, index):
+        row = self.row[index]
+        if self.row[self.goal[tile]] != row:
+            return 0
+        cost = 0
+        for i in range(row * self.dim[0], (row + 1) * self.dim[0]):
+            other = (state >> (i * self.bits)) & self.mask
+            if i == index or other == 0 or self.row[self.goal[other]] != row:
+                continue
+            if (i < index) == (self.goal[other] > self.goal[tile]):
+                cost += 2
+        return cost
+
+    def value(self, raw):
+        if self.factor == 1:
+            return raw
+        return int(raw * self.factor)
+
+
+# Walking distance: the raw value is the (row, column) key, a move changes
+# the key of the lines it moves across only
+class WalkingEvaluator(Evaluator):
+
+    def __init__(self, heuristic, dim, _goal=None):
+        Evaluator.__init__(self, heuristic, dim, _goal)
+        self.rows, self.cols = getWalkingDistance(dim)
+
+    def start(self, state):
+        return walkingKeys(unpackState(state, self.dim), self.dim)
+
+    def child(self, raw, state, tile, src, dst):
+        rowkey, colkey = raw
+        goal = self.goal[tile]
+        if self.row[src] != self.row[dst]:
+            rowkey += self.rows.weights[self.row[dst]][self.row[goal]] -\
+                self.rows.weights[self.row[src]][self.row[goal]] +\
+                (self.row[src] - self.row[dst]) * self.rows.blankweight
+        else:
+            colkey += self.cols.weights[self.col[dst]][self.col[goal]] -\
+                self.cols.weights[self.col[src]][self.col[goal]] +\
+                (self.col[src] - self.col[dst]) * self.cols.blankweight
+        return (rowkey, colkey)
+
+    def value(self, raw):
+        return self.rows.table[raw[0]] + self.cols.table[raw[1]]
+
+
+# Pattern databases: the raw value is the table index of every group, a
+# move changes the index of the moved tile's group only
+class PatternEvaluator(Evaluator):
+
+    def __init__(self, heuristic, dim, _goal=None):
+        Evaluator.__init__(self, heuristic, dim, _goal)
+        self.database = getPatternDatabase(dim)
+        self.slots = [None] * (dim[0] * dim[1])
+        for i, (group, weights) in enumerate(zip(self.database.groups,
+                                                 self.database.weights)):
+            for tile, weight in zip(group, weights):
+                self.slots[tile] = (i, weight)
+
+    def start(self, state):
+        where = [0] * (self.dim[0] * self.dim[1])
+        for i, tile in enumerate(unpackState(state, self.dim)):
+            where[tile] = i
+        return tuple(sum(where[tile] * weight
+                         for tile, weight in zip(group, weights))
+                     for group, weights in zip(self.database.groups,
+                                               self.database.weights))
+
+    def child(self, raw, state, tile, src, dst):
+        group, weight = self.slots[tile]
+        raw = list(raw)
+        raw[group] += (dst - src) * weight
+        return tuple(raw)
+
+    def value(self, raw):
+        cost = 0
+        for table, index in zip(self.database.tables, raw):
+            cost += table[index]
+        return cost
+
+
+# ######################## Packed states
+
+# Searches keep boards packed into a single int: tile i is stored in the
+# bits [i*bits, (i+1)*bits). Up to 4x4 a tile fits in a nibble, so a board
+# is a 64 bit int. It is hashable as-is and moves are shifts and masks.
+
+# Bits used per tile for a given dimension
+def stateBits(dim):
+    bits = 4
+    while (1 << bits) < dim[0] * dim[1]:
+        bits += 1
+    return bits
+
+
+# Pack a board (list) into an int
+def packState(board, dim):
+    bits = stateBits(dim)
+    state = 0
+    for i, tile in enumerate(board):
+        state |= tile << (i * bits)
+    return state
+
+
+# Unpack an int into a board (list)
+def unpackState(state, dim):
+    bits = stateBits(dim)
+    mask = (1 << bits) - 1
+    return [(state >> (i * bits)) & mask for i in range(dim[0] * dim[1])]
+
+
+# Return a board (list) for packed and unpacked states
+def getBoard(state, dim):
+    if isinstance(state, int):
+        return unpackState(state, dim)
+    return state
+
+
 # ######################## Additional functions for search
 
+# Return the move table of a dimension: table[izero][lastmove] holds
+# (move, index to swap) for every move possible with the empty tile at
+# izero, but the one taking back lastmove (-1 for none). The empty tile
+# swaps with the tile at izero - 1 (move 0), izero + dim[0] (1),
+# izero - dim[0] (2) or izero + 1 (3), so 3 - move takes a move back.
+def moveTable(dim):
+    if dim not in move_tables:
+        table = []
+        for izero in range(dim[0] * dim[1]):
+            row, col = divmod(izero, dim[0])
+            moves = tuple(
+                (move, izero + offset) for move, offset, possible in (
+                    (0, -1, col > 0),
+                    (1, dim[0], row < dim[1] - 1),
+                    (2, -dim[0], row > 0),
+                    (3, 1, col < dim[0] - 1))
+                if possible)
+            table.append([tuple(m for m in moves if m[0] != 3 - lastmove)
+                          for lastmove in range(4)] + [moves])
+        move_tables[dim] = table
+    return move_tables[dim]
+
+
 # highly used function!
 #
-# for a given state give possible next states
-def getNeighborStates(state, dim):
-    izero = state.index(0)
-    izero_fdiv, izero_mod = divmod(izero, dim[0])
-
-    # left:
-    iswap = izero - 1
-    if izero_fdiv == iswap // dim[0]:
-        left = state[:]
-        left[izero] = left[iswap]
-        left[iswap] = 0
-    else:
-        left = None
-
-    # up:
-    iswap = izero + dim[0]
-    if iswap < dim[0]*dim[1] and izero_mod == iswap % dim[0]:
-        up = state[:]
-        up[izero] = up[iswap]
-        up[iswap] = 0
-    else:
-        up = None
-
-    # down:
-    iswap = izero - dim[0]
-    if iswap >= 0 and izero_mod == iswap % dim[0]:
-        down = state[:]
-        down[izero] = down[iswap]
-        down[iswap] = 0
-    else:
-        down = None
-
-    # right:
-    iswap = izero + 1
-    if izero_fdiv == iswap // dim[0]:
-        right = state[:]
-        right[izero] = right[iswap]
-        right[iswap] = 0
-    else:
-        right = None
+# Yield (move, new state, index to swap, moved tile) for the moves from a
+# packed state, see moveTable
+def packedChildren(state, izero, lastmove, table, bits):
+    mask = (1 << bits) - 1
+    zshift = izero * bits
+    for move, iswap in table[izero][lastmove]:
+        tile = (state >> (iswap * bits)) & mask
+        yield (move, state ^ (tile << (iswap * bits)) | (tile << zshift),
+               iswap, tile)
+
+
+# Return the index the empty tile at izero swaps with by a move of a move
+# table, None if the move isn't possible
+def moveIndex(table, izero, move):
+    for possible, iswap in table[izero][-1]:
+        if possible == move:
+            return iswap
+    return None
+
+
+# Return the board (list) after a move, None if the move isn't possible
+def moveBoard(board, move, dim):
+    izero = board.index(0)
+    iswap = moveIndex(moveTable(dim), izero, move)
+    if iswap is None:
+        return None
+    board = board[:]
+    board[izero], board[iswap] = board[iswap], 0
+    return board
+
+
+# Return the plans known from the moves of a board: plans[state] is
+# (moves, index) for every board along them (along the first _length
+# moves only, if given), moves[index:] leading from that board to the same
+# goal. See replanMoves.
+def planBoards(board, dim, moves, _length=None):
+    bits = stateBits(dim)
+    table = moveTable(dim)
+    path = board[:]
+    state, izero = packState(path, dim), path.index(0)
+    plans = {state: (moves, 0)}
+    for i, move in enumerate(moves[:_length]):
+        iswap = moveIndex(table, izero, int(move))
+        tile = path[iswap]
+        path[izero], path[iswap] = tile, 0
+        state = state ^ (tile << (iswap * bits)) | (tile << (izero * bits))
+        izero = iswap
+        plans[state] = (moves, i + 1)
+    return plans
+
+
+# Return a plan for a board next to one of the known plans (see
+# planBoards), _depth limits the detour (default: replan_depth)
+#
+# A breadth first search from the board looks for the boards of the plans,
+# the shortest detour plus the rest of a plan wins. After a move off a plan
+# (the board before it being known), taking it back is found at depth 1.
+# The boards of the new plan are added to plans, so they can be replanned
+# from again.
+def replanMoves(board, dim, plans, _depth=None):
+    bits = stateBits(dim)
+    table = moveTable(dim)
+
+    state = packState(board, dim)
+    parents = {state: None}  # state: (parent state, move)
+    layer = [(state, board.index(0), -1)]
+    best = end = None
+    for depth in range((_depth or replan_depth) + 1):
+        for state, izero, lastmove in layer:
+            if state in plans:
+                moves, index = plans[state]
+                if best is None or depth + len(moves) - index < best:
+                    best, end = depth + len(moves) - index, state
+        if best is not None and best <= depth + 1:
+            break  # no deeper board can do better
+
+        children = []
+        for state, izero, lastmove in layer:
+            for move, newstate, iswap, tile in packedChildren(
+                    state, izero, lastmove, table, bits):
+                if newstate not in parents:
+                    parents[newstate] = (state, move)
+                    children.append((newstate, iswap, move))
+        layer = children
+    if end is None:
+        return None
+
+    detour = []
+    state = end
+    while parents[state] is not None:
+        state, move = parents[state]
+        detour.append((state, str(move)))
+    detour.reverse()
+
+    moves, index = plans[end]
+    plan = ''.join(move for state, move in detour) + moves[index:]
+    for i, (state, move) in enumerate(detour):
+        if state not in plans or \
+                len(plans[state][0]) - plans[state][1] > len(plan) - i:
+            plans[state] = (plan, i)
+    return plan
 
-    return (left, up, down, right)
+
+# ######################## Data structures for search
+
+# Objects of class BucketQueue are priority queues for small integer
+# priorities without any locking. Items are (f, g, payload) tuples like in
+# a PriorityQueue: the smallest f comes first, ties go to the larger g.
+# The payload is never compared.
+class BucketQueue(object):
+
+    def __init__(self):
+        self.buckets = []  # buckets[f][g] is a stack of items
+        self.fmin = 0
+        self.size = 0
+
+        return None
+
+    def put(self, item):
+        f, g = item[0], item[1]
+        while len(self.buckets) <= f:
+            self.buckets.append([])
+        bucket = self.buckets[f]
+        while len(bucket) <= g:
+            bucket.append([])
+        bucket[g].append(item)
+
+        self.size += 1
+        if f < self.fmin:
+            self.fmin = f
+
+    # empty stacks are dropped from the end of a bucket, so the last stack
+    # of a non-empty bucket is the one with the largest g
+    def get(self):
+        while not self.buckets[self.fmin]:
+            self.fmin += 1
+        bucket = self.buckets[self.fmin]
+        item = bucket[-1].pop()
+        while bucket and not bucket[-1]:
+            bucket.pop()
+
+        self.size -= 1
+        return item
+
+    # the item get() would return, without removing it
+    def peek(self):
+        while not self.buckets[self.fmin]:
+            self.fmin += 1
+        return self.buckets[self.fmin][-1][-1]
+
+    def empty(self):
+        return self.size == 0
+
+    def qsize(self):
+        return self.size
+
+
+# Objects of class NodePool keep the nodes of a search in arrays instead of
+# an object per node: packed state, index of the empty tile, path length,
+# parent node and the move from there (-1 for the root). Nodes are referred
+# to by their number, the moves of a path are only collected at the end.
+class NodePool(object):
+
+    def __init__(self, dim):
+        if stateBits(dim) * dim[0] * dim[1] <= 64:
+            self.states = array('Q')
+        else:
+            self.states = []  # packed states beyond 64 bits
+        self.izero = array('H')
+        self.g = array('i')
+        self.parent = array('i')
+        self.move = array('b')
+
+        return None
+
+    # Add a node, return its number
+    def add(self, state, izero, g, parent, move):
+        self.states.append(state)
+        self.izero.append(izero)
+        self.g.append(g)
+        self.parent.append(parent)
+        self.move.append(move)
+        return len(self.move) - 1
+
+    # Return the moves from the root to a node as str
+    def path(self, node):
+        moves = []
+        while self.parent[node] >= 0:
+            moves.append(str(self.move[node]))
+            node = self.parent[node]
+        return ''.join(reversed(moves))
+
+    def __len__(self):
+        return len(self.move)
 
 
 # ######################## Search functions
 
 # Do a search without ID
-def genericSearch(start_pos, end_state, _heurf=lambda p, d: 0,
-                  _data_struc=Queue, _debug=False):
-    visited = set()
+def genericSearch(start_pos, end_state, dim, _heuristic=None,
+                  _data_struc=Queue):
+    bits = stateBits(dim)
+
+    if _heuristic is None:
+        _heuristic = Heuristic("Zero", lambda p, d: 0)
+    evaluator = _heuristic.evaluator(dim)
+
+    table = moveTable(dim)
+    pool = NodePool(dim)
+    nodes = {}  # the node with the smallest g of every state
     frontier = _data_struc()
+    end = packState(end_state, dim)
 
-    global heuristic_calls
-    heuristic_calls = 0
-    max_frontier = 0
+    metrics.reset()
 
-    item = (_heurf(('', 0, start_pos), puzzle.dim), 1, (' ', start_pos))
-    frontier.put(item)
+    start = packState(start_pos, dim)
+    raw = evaluator.start(start)
+    node = pool.add(start, start_pos.index(0), 0, -1, -1)
+    frontier.put((evaluator.value(raw), 0, node, raw))
+    nodes[start] = node
 
     while not frontier.empty():
-        max_frontier = max(frontier.qsize(), max_frontier)
+        size = frontier.qsize()
+        if size > metrics.peak_frontier:
+            metrics.peak_frontier = size
+
+        fcost, plen, node, raw = frontier.get()
+
+        head = pool.states[node]
+        if nodes[head] != node:
+            metrics.pruned += 1
+            continue  # a better copy was put into the frontier
 
-        hcost, plen, path = frontier.get()
-        oldhcost = hcost - plen
         plen += 1
 
-        head = path[-1]
+        metrics.expanded += 1
+        if metrics.expanded >= metrics.due:
+            metrics.frontier, metrics.bound = size, fcost
+            metrics.progress()
+
+        if head == end:
+            return (pool.path(node), start_pos)
+
+        izero, lastmove = pool.izero[node], pool.move[node]
+        for move, new, iswap, tile in packedChildren(head, izero, lastmove,
+                                                     table, bits):
+            metrics.generated += 1
+            # a cheaper path reopens a state that was expanded already
+            # (with a heuristic that isn't consistent, like the PDB)
+            old = nodes.get(new)
+            if old is not None and pool.g[old] <= plen:
+                metrics.pruned += 1
+                continue
+            child = pool.add(new, iswap, plen, node, move)
+            nodes[new] = child
+            new_raw = evaluator.child(raw, head, tile, iswap, izero)
+            frontier.put((evaluator.value(new_raw) + plen, plen, child,
+                          new_raw))
+            metrics.heuristic_calls += 1
+    return None
 
-        if str(head) in visited:
-            continue
 
-        visited.add(str(head))
-
-        if head == end_state:
-            return (path[0][1:], start_pos)
-
-        l, u, d, r = getNeighborStates(head, puzzle.dim)
-
-        if l is not None and path[0][-1] != '3' and str(l) not in visited:
-            new_path = (path[0] + '0', l)
-            frontier.put((
-                _heurf(new_path, puzzle.dim, _oldheur=oldhcost) + plen,
-                plen, new_path))
-            heuristic_calls += 1
-
-        if u is not None and path[0][-1] != '2' and str(u) not in visited:
-            new_path = (path[0] + '1', u)
-            frontier.put((
-                _heurf(new_path, puzzle.dim, _oldheur=oldhcost) + plen,
-                plen, new_path))
-            heuristic_calls += 1
-
-        if d is not None and path[0][-1] != '1' and str(d) not in visited:
-            new_path = (path[0] + '2', d)
-            frontier.put((
-                _heurf(new_path, puzzle.dim, _oldheur=oldhcost) + plen,
-                plen, new_path))
-            heuristic_calls += 1
-
-        if r is not None and path[0][-1] != '0' and str(r) not in visited:
-            new_path = (path[0] + '3', r)
-            frontier.put((
-                _heurf(new_path, puzzle.dim, _oldheur=oldhcost) + plen,
-                plen, new_path))
-            heuristic_calls += 1
-
-        if _debug and len(visited) % 10000 == 0:
-            print("----------\n" +
-                  "Heur. calls:   " + str(heuristic_calls) + "\n" +
-                  "Visited nodes: " + str(len(visited)) + "\n" +
-                  "Max. frontier: " + str(max_frontier) + "\n" +
-                  "Cur Distance:  " + str(hcost) + " | " +
-                  str(hcost-plen+1) + "h, " + str(plen - 1) + "p")
+# Return the moves from the start to the goal through meet. forward and
+# backward map every state reached from the start (goal) to its
+# (parent, move, depth), the roots have no parent.
+def joinPaths(forward, backward, meet):
+    moves = []
+    state = meet
+    while forward[state][0] is not None:
+        state, move = forward[state][:2]
+        moves.append(str(move))
+    moves.reverse()
+
+    state = meet
+    while backward[state][0] is not None:
+        state, move = backward[state][:2]
+        moves.append(str(3 - move))  # backward moves are walked in reverse
+    return ''.join(moves)
+
+
+# Do a BFS from the start and the goal at the same time
+#
+# Whole layers are expanded on the side with the smaller frontier. The
+# cheapest meeting in the first layer which meets the other side is optimal.
+def bidirectionalSearch(start_pos, end_state, dim, heuristic):
+    metrics.reset()
+    bits = stateBits(dim)
+    table = moveTable(dim)
+
+    start = packState(start_pos, dim)
+    end = packState(end_state, dim)
+    if start == end:
+        return ('', start_pos)
+
+    reached = ({start: (None, -1, 0)}, {end: (None, -1, 0)})
+    layers = ([(start, start_pos.index(0))], [(end, end_state.index(0))])
+
+    while layers[0] and layers[1]:
+        side = 0 if len(layers[0]) <= len(layers[1]) else 1
+        own, other = reached[side], reached[1 - side]
+        meet, cost = None, math.inf
+        layer = []
+
+        metrics.frontier = len(layers[0]) + len(layers[1])
+        metrics.peak_frontier = max(metrics.peak_frontier, metrics.frontier)
+        metrics.bound = (reached[0][layers[0][0][0]][2] +
+                         reached[1][layers[1][0][0]][2] + 1)
+        for state, izero in layers[side]:
+            parent, lastmove, depth = own[state]
+            depth += 1
+            metrics.expanded += 1
+            if metrics.expanded >= metrics.due:
+                metrics.progress()
+            for move, new, iswap, tile in packedChildren(state, izero,
+                                                         lastmove, table,
+                                                         bits):
+                metrics.generated += 1
+                if new in own:
+                    metrics.pruned += 1
+                    continue
+                own[new] = (state, move, depth)
+                layer.append((new, iswap))
+                if new in other and depth + other[new][2] < cost:
+                    meet, cost = new, depth + other[new][2]
+
+        if meet is not None:
+            return (joinPaths(reached[0], reached[1], meet), start_pos)
+        layers = (layer, layers[1]) if side == 0 else (layers[0], layer)
     return None
 
 
+# Do a bidirectional A* meeting in the middle (MM)
+#
+# Both sides prefer nodes with the smallest max(g + h, 2g), so neither
+# side searches past the middle of the solution. The best meeting U is
+# optimal as soon as no node in a frontier has a smaller priority.
+# Heuristics which can't estimate the distance to the start board use the
+# manhattan distance backwards.
+def mmSearch(start_pos, end_state, dim, heuristic):
+    metrics.reset()
+    bits = stateBits(dim)
+    table = moveTable(dim)
+
+    try:
+        backward = heuristic.evaluator(dim, start_pos)
+    except ValueError:
+        backward = ManhattanEvaluator(heuristic, dim, start_pos)
+    evaluators = (heuristic.evaluator(dim), backward)
+
+    start = packState(start_pos, dim)
+    end = packState(end_state, dim)
+    if start == end:
+        return ('', start_pos)
+
+    reached = ({start: (None, -1, 0)}, {end: (None, -1, 0)})
+    frontiers = (BucketQueue(), BucketQueue())
+    for side, (state, board) in enumerate(((start, start_pos),
+                                           (end, end_state))):
+        raw = evaluators[side].start(state)
+        frontiers[side].put((evaluators[side].value(raw), 0,
+                             (state, board.index(0), raw)))
+
+    meet, cost = None, math.inf
+    while not frontiers[0].empty() and not frontiers[1].empty():
+        # drop copies of nodes which were reached cheaper in the meantime
+        stale = False
+        for side in (0, 1):
+            prio, g, (state, izero, raw) = frontiers[side].peek()
+            if reached[side][state][2] < g:
+                frontiers[side].get()
+                metrics.pruned += 1
+                stale = True
+        if stale:
+            continue
+
+        first = (frontiers[0].peek()[0], frontiers[1].peek()[0])
+        if cost <= min(first):
+            break
+
+        side = 0 if first[0] <= first[1] else 1
+        own, other = reached[side], reached[1 - side]
+        evaluator = evaluators[side]
+        metrics.frontier = frontiers[0].qsize() + frontiers[1].qsize()
+        metrics.peak_frontier = max(metrics.peak_frontier, metrics.frontier)
+        prio, g, (state, izero, raw) = frontiers[side].get()
+        metrics.expanded += 1
+        if metrics.expanded >= metrics.due:
+            metrics.bound = min(first)
+            metrics.progress()
+        g += 1
+
+        for move, new, iswap, tile in packedChildren(state, izero,
+                                                     own[state][1], table,
+                                                     bits):
+            metrics.generated += 1
+            if new in own and own[new][2] <= g:
+                metrics.pruned += 1
+                continue
+            own[new] = (state, move, g)
+            new_raw = evaluator.child(raw, state, tile, iswap, izero)
+            frontiers[side].put((max(evaluator.value(new_raw) + g, 2 * g), g,
+                                 (new, iswap, new_raw)))
+            metrics.heuristic_calls += 1
+            if new in other and g + other[new][2] < cost:
+                meet, cost = new, g + other[new][2]
+
+    if meet is None:
+        return None
+    return (joinPaths(reached[0], reached[1], meet), start_pos)
+
+
+# Do an anytime repairing A* (ARA*), yield (moves, start_pos, bound)
+# for every better solution
+#
+# Each round is a weighted A* with priority g + w*h, starting with the
+# first of _weights. Nodes whose g gets smaller after they were expanded
+# wait in incons for the next round, which keeps all other nodes and only
+# sorts the frontier again for the next weight. The solution is at most
+# bound times longer than an optimal one; the last has bound 1 (with an
+# admissible heuristic). The last weight is repeated while there are
+# inconsistent nodes. Priorities are kept as integers, in quarters.
+def araSolutions(start_pos, end_state, dim, heuristic,
+                 _weights=(3, 2, 1.5, 1.25, 1)):
+    bits = stateBits(dim)
+    table = moveTable(dim)
+    evaluator = heuristic.evaluator(dim)
+
+    metrics.reset()
+    metrics.suboptimality = None
+
+    start = packState(start_pos, dim)
+    end = packState(end_state, dim)
+    cost = {start: 0}  # g
+    parents = {start: (None, -1)}  # state -> (parent, move)
+    waiting = {start: (start_pos.index(0), evaluator.start(start))}
+    incons = {}  # like waiting, for the next round
+    hend = evaluator.value(evaluator.start(end))
+    best, bestbound = None, math.inf
+    rounds = 0
+
+    while True:
+        weight = _weights[min(rounds, len(_weights) - 1)]
+        rounds += 1
+        quarters = int(weight * 4)
+        waiting.update(incons)
+        incons = {}
+        closed = set()
+
+        frontier = BucketQueue()
+        for state, (izero, raw) in waiting.items():
+            g = cost[state]
+            frontier.put((4 * g + quarters * evaluator.value(raw), g,
+                          (state, izero, raw)))
+
+        # stop when no node has a smaller priority than the goal
+        while not frontier.empty() and frontier.peek()[0] < \
+                4 * cost.get(end, math.inf) + quarters * hend:
+            size = frontier.qsize()
+            if size > metrics.peak_frontier:
+                metrics.peak_frontier = size
+
+            prio, g, (state, izero, raw) = frontier.get()
+            if state not in waiting or cost[state] < g:
+                metrics.pruned += 1
+                continue  # expanded already or found cheaper
+            del waiting[state]
+            closed.add(state)
+
+            metrics.expanded += 1
+            if metrics.expanded >= metrics.due:
+                metrics.frontier = size
+                metrics.progress()
+
+            g += 1
+            for move, new, iswap, tile in packedChildren(
+                    state, izero, parents[state][1], table, bits):
+                metrics.generated += 1
+                if cost.get(new, g + 1) <= g:
+                    metrics.pruned += 1
+                    continue
+                cost[new] = g
+                parents[new] = (state, move)
+                new_raw = evaluator.child(raw, state, tile, iswap, izero)
+                metrics.heuristic_calls += 1
+                if new in closed:
+                    incons[new] = (iswap, new_raw)
+                else:
+                    waiting[new] = (iswap, new_raw)
+                    frontier.put((4 * g + quarters * evaluator.value(new_raw),
+                                  g, (new, iswap, new_raw)))
+
+        if end not in cost:
+            if not waiting:
+                return  # no solution
+            continue
+
+        # the solution can't be shorter than any g + h in the frontier
+        lower = min([cost[state] + evaluator.value(raw)
+                     for nodes in (waiting, incons)
+                     for state, (izero, raw) in nodes.items()],
+                    default=cost[end])
+        bound = max(1, min(weight, cost[end] / lower)) if lower > 0 else 1
+        metrics.bound = min(lower, cost[end])
+        metrics.iteration(weight)
+
+        if best is None or cost[end] < len(best) or bound < bestbound:
+            moves = []
+            state = end
+            while parents[state][0] is not None:
+                state, move = parents[state]
+                moves.append(str(move))
+            best, bestbound = ''.join(reversed(moves)), bound
+            metrics.suboptimality = bound
+            yield (best, start_pos, bound)
+
+        if bound <= 1 or (rounds >= len(_weights) and not incons):
+            return
+
+
+# Do ARA* until the solution is optimal. A progress hook raising
+# SearchStopped ends it early with the best solution so far (see
+# metrics.suboptimality).
+def araSearch(start_pos, end_state, dim, heuristic):
+    solution = None
+    try:
+        for moves, board, bound in araSolutions(start_pos, end_state, dim,
+                                                heuristic):
+            solution = (moves, board)
+    except SearchStopped:
+        if solution is None:
+            raise
+    return solution
+
+
 # Do a search with IDA
-def idaSearch(start_pos, end_state, heurf, _data_struc=Queue, _debug=False):
-    global global_added_nodes
-    global_added_nodes = 0
+def idaSearch(start_pos, end_state, dim, heuristic, _data_struc=Queue):
+    metrics.reset()
 
     # for increasing bound by 2 you need to find the right start bound
     # that is 1 the MD of the blank tile to its final position is odd, 0 else
-    y, x = getStatePosition(start_pos, puzzle.dim, 0)
-    dist = abs(x - puzzle.dim[0]) + abs(y - puzzle.dim[1])
+    y, x = getStatePosition(start_pos, dim, 0)
+    dist = abs(x - dim[0]) + abs(y - dim[1])
     bound = (dist % 2)
-    if _debug:
-        tstart = timer()
-        prev_elapsed = 0
+
+    evaluator = heuristic.evaluator(dim)
+    start = packState(start_pos, dim)
+    end = packState(end_state, dim)
+    root = ("x", start, start_pos.index(0), evaluator.start(start))
 
     while True:
-        path = idaIteration(["x", start_pos], bound, end_state, heurf, _debug)
+        metrics.bound = bound
+        path = idaIteration(root, bound, end, evaluator)
+        metrics.iteration(bound)
 
         if path is not None:
             return [path[0][1:], start_pos]
-
-        if _debug:
-            tnow = timer()
-            elapsed_time = tnow - tstart
-            diff = elapsed_time - prev_elapsed
-            prev_elapsed = elapsed_time
-            print("Iteration " + str(bound) + " done in " + str(elapsed_time) +
-                  " (cumulated)" + " add.: " + str(diff))
         bound += 2
 
 
 # Used by IDA to search until a given bound
-def idaIteration(path, bound, end_state, heur, debug):
-    global global_added_nodes
+def idaIteration(path, bound, end_state, evaluator):
+    dim = evaluator.dim
+    bits = stateBits(dim)
+    table = moveTable(dim)
 
-    visited = set()
-    visited.add(str(path[-1]))
     visited_dict = {}
-    visited_dict[str(path[-1])] = 0
+    visited_dict[path[1]] = 0
     frontier = []
     frontier.append(path)
 
-    added_nodes = 0
-
-    start = timer()
-    stop = timer()
     while frontier:
+        if len(frontier) > metrics.peak_frontier:
+            metrics.peak_frontier = len(frontier)
         path = frontier.pop()
-        moves = path[0]
-        node = path[-1]
+        moves, node, izero, raw = path
         if node == end_state:
-            if debug:
-                print("Visited: " + str(len(visited)))
             return path
 
+        metrics.expanded += 1
+        if metrics.expanded >= metrics.due:
+            metrics.frontier = len(frontier)
+            metrics.progress()
+
         # moves includes start-symbol x, therefore subtract 1
         movelen = len(moves) - 1
 
-        if debug:
-            current_added = added_nodes
-            print("Visited: " + str(len(visited)))
-
-        l, u, d, r = getNeighborStates(node, puzzle.dim)
-
-        estlen = 0
-        string = ""
-        if l is not None and moves[-1] != '3':
-            estlen = movelen + heur([l], puzzle.dim)
-            if estlen <= bound:
-                string = str(l)
-                if string not in visited or visited_dict[string] > estlen:
-                    global_added_nodes = added_nodes = added_nodes + 1
-                    visited_dict[string] = estlen
-                    visited.add(string)
-                    frontier.append((moves + '0', l))
-
-        if u is not None and moves[-1] != '2':
-            estlen = movelen + heur([u], puzzle.dim)
-            if estlen <= bound:
-                string = str(u)
-                if string not in visited or visited_dict[string] > estlen:
-                    global_added_nodes = added_nodes = added_nodes + 1
-                    visited_dict[string] = estlen
-                    visited.add(string)
-                    frontier.append((moves + '1', u))
-
-        if d is not None and moves[-1] != '1':
-            estlen = movelen + heur([d], puzzle.dim)
-            if estlen <= bound:
-                string = str(d)
-                if string not in visited or visited_dict[string] > estlen:
-                    global_added_nodes = added_nodes = added_nodes + 1
-                    visited_dict[string] = estlen
-                    visited.add(string)
-                    frontier.append((moves + '2', d))
-
-        if r is not None and moves[-1] != '0':
-            estlen = movelen + heur([r], puzzle.dim)
-            if estlen <= bound:
-                string = str(r)
-                if string not in visited or visited_dict[string] > estlen:
-                    global_added_nodes = added_nodes = added_nodes + 1
-                    visited_dict[string] = estlen
-                    visited.add(string)
-                    frontier.append((moves + '3', r))
-
-        if debug and current_added//10000 != added_nodes//10000:
-            stop = timer()
-            deltaSecs = (stop - start)
-            start = timer()
-            print("\nCurrent State: ")
-            print(node)
-            print("\nPath: ")
-            print(moves)
-            print("\nLength Path: ", movelen)
-            print("Bound: ", bound)
-            print("Heuristic: ", heur(path, puzzle.dim))
-            print("Length+Heuristic: ", estlen)
-            print("Added nodes: ", added_nodes)
-            print("Global added nodes: ", global_added_nodes)
-            print("Closed nodes: ", len(visited))
-            print("Stack Length: ", len(frontier))
-            print('')
-            print("Used Time: {}s".format(deltaSecs))
+        lastmove = int(moves[-1]) if movelen > 0 else -1
+
+        for move, new, iswap, tile in packedChildren(node, izero, lastmove,
+                                                     table, bits):
+            new_raw = evaluator.child(raw, node, tile, iswap, izero)
+            estlen = movelen + evaluator.value(new_raw)
+            metrics.generated += 1
+            metrics.heuristic_calls += 1
+            if estlen <= bound and visited_dict.get(new, estlen + 1) > estlen:
+                visited_dict[new] = estlen
+                frontier.append((moves + str(move), new, iswap, new_raw))
+            else:
+                metrics.pruned += 1
     return None
 
 
+# Raised inside a search that was told to stop
+class SearchStopped(Exception):
+    pass
+
+
+# Create the depth first part of an IDA iteration on a single state
+#
+# Moves are made and taken back in place (a move is a xor on the packed
+# state), so memory only grows with the depth of the path. The returned
+# function searches below a state until bound and returns None if solved
+# (path then holds the moves), the smallest f-value above bound else.
+# counts holds expanded and generated nodes, _stop() is polled every
+# _interval (a power of 2) expanded nodes and makes the search raise
+# SearchStopped. _table is a
+# TranspositionTable (see there) to look nodes up in and store them.
+# _estimate(state, izero, h) may replace the heuristic value h, it returns
+# (h, moves) with the moves left to the goal if they are known (the search
+# ends there then).
+#
+# The search refers to itself, iteration(None) drops it when it is no
+# longer needed (and with it the table, without waiting for the garbage
+# collector).
+def idaDepthFirst(dim, evaluator, end_state, path, counts, _stop=None,
+                  _table=None, _estimate=None, _interval=4096):
+    bits = stateBits(dim)
+    mask = (1 << bits) - 1
+    pollmask = _interval - 1
+
+    table = moveTable(dim)
+
+    state = 0
+    bound = 0
+
+    def search(izero, g, lastmove):
+        nonlocal state
+
+        h, rest = evaluator.value(evaluator.raw), None
+        if _estimate is not None:
+            h, rest = _estimate(state, izero, h)
+        f = g + h
+        if _table is not None:
+            f = _table.probe(state, g, f)
+        if f > bound:
+            return f
+        if state == end_state:
+            return None
+        if rest is not None:
+            path.extend(int(move) for move in rest)
+            return None
+
+        counts[0] += 1
+        if _stop is not None and counts[0] & pollmask == 0 and _stop():
+            raise SearchStopped()
+
+        if _table is not None:
+            expanded = counts[0]
+            _table.enter(state, g, f)
+
+        minimum = math.inf
+        for move, iswap in table[izero][lastmove]:
+            tile = (state >> (iswap * bits)) & mask
+            swap = (tile << (iswap * bits)) | (tile << (izero * bits))
+
+            evaluator.apply(state, tile, iswap, izero)
+            state ^= swap
+            path.append(move)
+            counts[1] += 1
+
+            t = search(iswap, g + 1, move)
+            if t is None:
+                return None
+
+            path.pop()
+            state ^= swap
+            evaluator.undo()
+
+            if t < minimum:
+                minimum = t
+
+        if _table is not None:
+            _table.leave(state, g, minimum, counts[0] - expanded)
+        return minimum
+
+    def iteration(start, izero=0, g=0, lastmove=-1, _bound=0):
+        nonlocal state, bound, search
+        if start is None:
+            search = None
+            return None
+        state, bound = start, _bound
+        evaluator.reset(start)
+        return search(izero, g, lastmove)
+
+    return iteration
+
+
+# Do a depth first IDA on a single state, with an optional transposition
+# table and estimate (see idaDepthFirst)
+#
+# The next bound is the smallest f-value that exceeded the current one.
+# The counts of the depth first search reach the metrics when a progress
+# hook is due (polled every 4096 nodes, or as often as it takes to call
+# each hook at the exact count, e.g. for a node budget), at the end of each
+# iteration else.
+def idaInplaceSearch(start_pos, end_state, dim, heuristic, _table=None,
+                     _estimate=None):
+    metrics.reset()
+
+    evaluator = heuristic.evaluator(dim)
+    start = packState(start_pos, dim)
+    path = []
+    counts = [0, 0]
+
+    def count():
+        metrics.expanded, metrics.generated = counts
+        metrics.heuristic_calls = counts[1]
+        metrics.pruned = counts[1] - counts[0]  # cut off by bound or table
+        metrics.frontier = len(path)
+
+    def poll():
+        if counts[0] >= metrics.due:
+            count()
+            metrics.progress()
+        return False
+
+    interval = 4096
+    for hook in metrics.hooks:
+        interval = math.gcd(interval, hook[1])
+    iteration = idaDepthFirst(dim, evaluator, packState(end_state, dim),
+                              path, counts, poll if metrics.hooks else None,
+                              _table, _estimate, interval)
+
+    bound = evaluator.reset(start)
+    if _estimate is not None:
+        bound = _estimate(start, start_pos.index(0), bound)[0]
+
+    try:
+        while True:
+            metrics.bound = metrics.peak_frontier = bound  # no longer paths
+            try:
+                t = iteration(start, start_pos.index(0), 0, -1, bound)
+            finally:
+                count()
+            metrics.iteration(bound)
+
+            if t is None:
+                return (''.join(str(move) for move in path), start_pos)
+            if t == math.inf:
+                return None  # no solution
+            bound = t
+    finally:
+        iteration(None)
+
+
+# Objects of class TranspositionTable hold a fixed number of IDA* nodes,
+# kept across iterations. Every packed state has one slot (by its hash)
+# with the smallest g it was reached with, its backed-up f-value (the
+# smallest f beyond the bound below it) and the number of nodes expanded
+# below it. A slot only changes hands for a node with a smaller g or the
+# same g and more nodes, so the big subtrees near the root are kept.
+#
+# A node reached before on a shorter path is cut off, one reached on a
+# path as short takes its backed-up f-value if larger than its own. Nodes
+# are stored when entered, so the path's own nodes cut off cycles, and
+# their f-value is updated when left.
+class TranspositionTable(object):
+
+    unknown = 0xffff  # g of empty slots, f of dead ends
+
+    # Initialize with dimension of game and memory budget (MiB). A slot
+    # takes 16 bytes, beyond 64 bits the packed state is an int object of
+    # its own (a pointer in a list instead of 8 bytes in the array).
+    def __init__(self, dim, budget):
+        bits = stateBits(dim) * dim[0] * dim[1]
+        slot = 16
+        if bits > 64:
+            slot += sys.getsizeof(1 << (bits - 1))
+        self.size = max(1, (budget << 20) // slot)
+        if bits <= 64:
+            self.states = array('Q', bytes(8 * self.size))
+        else:
+            self.states = [0] * self.size  # packed states beyond 64 bits
+        self.g = array('H', b'\xff\xff' * self.size)
+        self.f = array('H', bytes(2 * self.size))
+        self.work = array('I', bytes(4 * self.size))
+
+        return None
+
+    # f-value of a node reached with g and estimated f (inf: cut off)
+    def probe(self, state, g, f):
+        slot = hash(state) % self.size
+        if self.states[slot] == state and self.g[slot] <= g:
+            if self.g[slot] < g:
+                return math.inf  # searched on a shorter path
+            if self.f[slot] > f:
+                return self.f[slot] if self.f[slot] < self.unknown \
+                    else math.inf
+        return f
+
+    # Store a node when it is entered
+    def enter(self, state, g, f):
+        slot = hash(state) % self.size
+        if self.states[slot] == state or self.g[slot] > g or \
+                (self.g[slot] == g and self.work[slot] == 0):
+            self.states[slot], self.g[slot] = state, g
+            self.f[slot], self.work[slot] = f, 0
+
+    # Store a node when it is left, with the smallest f beyond the bound
+    # below it and the number of nodes expanded there
+    def leave(self, state, g, f, work):
+        slot = hash(state) % self.size
+        work = min(work, 0xffffffff)
+        if self.states[slot] == state or self.g[slot] > g or \
+                (self.g[slot] == g and self.work[slot] <= work):
+            self.states[slot], self.g[slot] = state, g
+            self.f[slot], self.work[slot] = min(f, self.unknown), work
+
+
+# Do a depth first IDA with a transposition table (see there), _budget
+# is its size in MiB (default: tt_budget)
+def idaTableSearch(start_pos, end_state, dim, heuristic, _budget=None):
+    return idaInplaceSearch(start_pos, end_state, dim, heuristic,
+                            TranspositionTable(dim, _budget or tt_budget))
+
+
+# Do a depth first IDA towards the perimeter of the solved board (see
+# Perimeter), _depth is its depth (default: perimeter_depth)
+#
+# Boards on the perimeter have their exact distance as heuristic value,
+# all others are at least one move further away than its depth (and as
+# far as the parity of the moves left allows). The search ends on the
+# first board of the perimeter within the bound and appends that board's
+# moves to the solved board.
+def perimeterSearch(start_pos, end_state, dim, heuristic, _depth=None):
+    if end_state != Puzzle(*dim).initcopy():
+        raise ValueError("Perimeter search needs the solved board as goal")
+    perimeter = getPerimeter(dim, _depth or perimeter_depth)
+    paths, outside = perimeter.paths, perimeter.depth + 1
+
+    # every move moves the empty tile, so the number of moves left has the
+    # parity of its distance to the last place
+    parity = [(dim[0] - 1 - izero % dim[0] + dim[1] - 1 - izero // dim[0]) & 1
+              for izero in range(dim[0] * dim[1])]
+
+    # heuristic value of the state, the moves left if on the perimeter
+    def estimate(state, izero, h):
+        rest = paths.get(state)
+        if rest is not None:
+            return len(rest), rest
+        if h < outside:
+            h = outside
+        return h + ((h + parity[izero]) & 1), None
+
+    return idaInplaceSearch(start_pos, end_state, dim, heuristic,
+                            _estimate=estimate)
+
+
+# Worker processes of the parallel IDA share a stop event and keep one
+# depth first search (see idaDepthFirst) for all their subtrees
+def initIdaWorker(dim, heuristic, end_state, stop):
+    global worker_iteration, worker_path, worker_counts, worker_stop
+    worker_path = []
+    worker_counts = [0, 0]
+    worker_stop = stop.is_set
+    worker_iteration = idaDepthFirst(dim, heuristic.evaluator(dim),
+                                     end_state, worker_path, worker_counts,
+                                     stop.is_set)
+
+
+# Search a subtree until bound in a worker process
+def idaWorker(task):
+    (moves, state, izero, lastmove), bound = task
+    del worker_path[:]
+    worker_counts[0] = worker_counts[1] = 0
+    if worker_stop():  # another subtree has the solution already
+        return None, math.inf, worker_counts[:], os.getpid()
+
+    try:
+        t = worker_iteration(state, izero, len(moves), lastmove, bound)
+    except SearchStopped:
+        t = math.inf
+
+    if t is None:
+        moves += ''.join(str(move) for move in worker_path)
+    else:
+        moves = None
+    return moves, t, worker_counts[:], os.getpid()
+
+
+# Do IDA on several processes
+#
+# The first levels of the tree are expanded breadth first into at least
+# 16 subtrees per process, or until a level doesn't grow. Every iteration
+# hands them out one by one, so a process that is done takes the next one.
+# All processes stop as soon as one finds a solution (subtrees handed out
+# later are skipped); it is optimal as every subtree had the same bound.
+#
+# Daemonic processes (the workers of batch mode) can't have children of
+# their own, they do an in-place IDA instead.
+def idaParallelSearch(start_pos, end_state, dim, heuristic, _processes=None):
+    if multiprocessing.current_process().daemon:
+        return idaInplaceSearch(start_pos, end_state, dim, heuristic)
+
+    metrics.reset()
+
+    processes = _processes or os.cpu_count()
+    bits = stateBits(dim)
+    table = moveTable(dim)
+    evaluator = heuristic.evaluator(dim)
+    start = packState(start_pos, dim)
+    end = packState(end_state, dim)
+
+    # roots of the subtrees: (moves, state, index of empty tile, last move)
+    roots = [('', start, start_pos.index(0), -1)]
+    while len(roots) < 16 * processes:
+        subroots = []
+        for moves, state, izero, lastmove in roots:
+            if state == end:  # breadth first, so this is optimal
+                return (moves, start_pos)
+            metrics.expanded += 1
+            for move, new, iswap, tile in packedChildren(state, izero,
+                                                         lastmove, table,
+                                                         bits):
+                subroots.append((moves + str(move), new, iswap, move))
+                metrics.generated += 1
+        grown = len(subroots) > len(roots)
+        roots = subroots
+        if not grown:  # tiny boards never get enough roots
+            break
+
+    bound = evaluator.reset(start)
+    stop = multiprocessing.Event()
+
+    # progress hooks run here whenever a subtree is done
+    with multiprocessing.Pool(processes, initIdaWorker,
+                              (dim, heuristic, end, stop)) as pool:
+        while True:
+            metrics.bound = bound
+            metrics.frontier = len(roots)
+            metrics.peak_frontier = len(roots) + bound
+            stop.clear()
+            solution = None
+            minimum = math.inf
+
+            tasks = [(root, bound) for root in roots]
+            for moves, t, counts, pid in pool.imap_unordered(idaWorker, tasks):
+                metrics.expanded += counts[0]
+                metrics.generated += counts[1]
+                metrics.heuristic_calls += counts[1]
+                metrics.pruned += counts[1] - counts[0]
+                metrics.workers[pid] = metrics.workers.get(pid, 0) + counts[0]
+                if metrics.expanded >= metrics.due:
+                    metrics.progress()
+
+                if moves is not None:
+                    if solution is None:
+                        solution = moves
+                        stop.set()
+                elif t < minimum:
+                    minimum = t
+            metrics.iteration(bound)
+
+            if solution is not None:
+                return (solution, start_pos)
+            if minimum == math.inf:
+                return None  # no solution
+            bound = minimum
+
+
+# Objects of class MacroSolver solve large boards suboptimally, but in
+# polynomial time: the top row or left column (the longer one) of the
+# unsolved part is solved tile by tile, until 2x2 tiles are left.
+#
+# A tile is routed on a shortest path around the solved tiles and for every
+# step the empty tile goes in front of it (again on a shortest path, around
+# the tile). The last two tiles of a line need a macro: the last tile goes
+# to the place of the second last, that one next to it, then two moves of
+# the empty tile rotate both into place.
+class MacroSolver(object):
+
+    # Initialize with a board (list) and its dimension
+    def __init__(self, board, dim):
+        self.dim = dim
+        self.board = board[:]
+        self.izero = board.index(0)
+        self.locked = [False] * len(board)  # solved places
+        self.moves = []
+
+        # (move, neighbor) for every place, see moveTable
+        self.adjacent = [moves[-1] for moves in moveTable(dim)]
+
+    # Return a shortest path (places without start) from start to goal,
+    # around the solved places and _avoid
+    def path(self, start, goal, _avoid=None):
+        parents = {start: None}
+        queue = deque([start])
+        while queue:
+            index = queue.popleft()
+            metrics.expanded += 1
+            if index == goal:
+                path = []
+                while index != start:
+                    path.append(index)
+                    index = parents[index]
+                return path[::-1]
+            for move, neighbor in self.adjacent[index]:
+                if neighbor not in parents and neighbor != _avoid and \
+                        not self.locked[neighbor]:
+                    parents[neighbor] = index
+                    queue.append(neighbor)
+        raise ValueError("No path to place " + str(goal))
+
+    # Move the empty tile to a neighboring place
+    def step(self, index):
+        for move, neighbor in self.adjacent[self.izero]:
+            if neighbor == index:
+                self.board[self.izero] = self.board[index]
+                self.board[index] = 0
+                self.izero = index
+                self.moves.append(str(move))
+                return None
+
+    # Move the empty tile to a place, around _avoid
+    def moveEmpty(self, goal, _avoid=None):
+        for index in self.path(self.izero, goal, _avoid):
+            self.step(index)
+
+    # Move a tile to a place
+    def moveTile(self, tile, goal):
+        index = self.board.index(tile)
+        for place in self.path(index, goal):
+            self.moveEmpty(place, index)
+            self.step(index)
+            index = place
+            if metrics.expanded >= metrics.due:
+                metrics.progress()
+
+    # Solve a line of places (in order), side is the offset of the
+    # neighboring places in the next line
+    def solveLine(self, line, side):
+        for place in line[:-2]:
+            self.moveTile(place + 1, place)
+            self.locked[place] = True
+
+        last, end = line[-2:]
+        if self.board[last] != last + 1 or self.board[end] != end + 1:
+            self.moveTile(end + 1, last)
+            self.locked[last] = True
+            if self.izero == end:  # a dead end now
+                self.step(end + side)
+            if self.board[end] == last + 1:
+                # the second last tile is stuck in the corner, the empty
+                # tile goes below it and rotates both in (found by BFS)
+                self.moveEmpty(end + side, end)
+                square = [last, end, last + side, end + side,
+                          last + 2 * side, end + 2 * side]
+                for i in (1, 0, 2, 3, 5, 4, 2, 0, 1, 3, 2, 4, 5, 3, 1, 0, 2):
+                    self.step(square[i])
+                self.locked[end] = True
+                return None
+            self.moveTile(last + 1, last + side)
+            self.locked[last + side] = True
+            self.moveEmpty(end)
+            self.locked[last] = self.locked[last + side] = False
+            self.step(last)
+            self.step(last + side)
+        self.locked[last] = self.locked[end] = True
+
+    # Solve the board, return the moves as str
+    def solve(self):
+        top, left = 0, 0
+        width, height = self.dim
+        while width > 2 or height > 2:
+            if height >= width:
+                line = [top * self.dim[0] + col
+                        for col in range(left, self.dim[0])]
+                self.solveLine(line, self.dim[0])
+                top, height = top + 1, height - 1
+            else:
+                line = [row * self.dim[0] + left
+                        for row in range(top, self.dim[1])]
+                self.solveLine(line, 1)
+                left, width = left + 1, width - 1
+
+        # the last 2x2 tiles: every round of the empty tile turns the other
+        # three by one place, turn them right or left
+        corner = top * self.dim[0] + left
+        square = [corner, corner + 1, corner + 1 + self.dim[0],
+                  corner + self.dim[0]]
+        self.moveEmpty(square[2])
+        goal = [place + 1 for place in square[:2]] + [0, square[3] + 1]
+        for order in ((), (3, 0, 1, 2), (1, 0, 3, 2)):
+            board, izero, count = self.board[:], self.izero, len(self.moves)
+            for i in order:
+                self.step(square[i])
+            if [self.board[place] for place in square] == goal:
+                break
+            self.board, self.izero = board, izero
+            del self.moves[count:]
+        return ''.join(self.moves)
+
+
+# Cut the loops out of a move sequence: wherever it comes back to an
+# earlier board, the moves in between are dropped. Boards are recognized
+# by a Zobrist hash (random bits for every tile on every place, xored),
+# which is updated per move.
+def shortenMoves(board, dim, moves, _rnd=random):
+    board = board[:]
+    izero = board.index(0)
+    keys = [[_rnd.getrandbits(64) for place in board] for tile in board]
+    key = 0
+    for place, tile in enumerate(board):
+        key ^= keys[tile][place]
+
+    table = moveTable(dim)
+    kept = []
+    keylist = [key]  # the hash after every kept move
+    seen = {key: 0}
+    for move in moves:
+        index = moveIndex(table, izero, int(move))
+        tile = board[index]
+        key ^= (keys[tile][index] ^ keys[tile][izero] ^
+                keys[0][izero] ^ keys[0][index])
+        board[izero], board[index] = tile, 0
+        izero = index
+
+        if key in seen:  # back to an earlier board
+            length = seen[key]
+            for dropped in keylist[length + 1:]:
+                del seen[dropped]
+            del kept[length:], keylist[length + 1:]
+        else:
+            kept.append(move)
+            keylist.append(key)
+            seen[key] = len(kept)
+    return ''.join(kept)
+
+
+# Solve with a MacroSolver (see there), the heuristic isn't used. Other
+# goals than the solved board need the empty tile in the last place.
+def macroSearch(start_pos, end_state, dim, heuristic):
+    metrics.reset()
+
+    if end_state.index(0) != len(end_state) - 1:
+        raise ValueError("The macro solver needs the empty tile last")
+    goal = {tile: place for place, tile in enumerate(end_state)}
+    board = [(goal[tile] + 1) % len(start_pos) for tile in start_pos]
+    if not isSolvable(board, dim):
+        return None  # no solution
+
+    moves = MacroSolver(board, dim).solve()
+    return (shortenMoves(board, dim, moves), start_pos)
+
+
 # ######################## GUI
 
-@window.event
+# Create the window and the key bindings (only the GUI needs pyglet)
+def initGUI():
+    global pyglet, key, window, maxdimension, bgimg, keys, panel
+
+    import pyglet  # INSTALL
+    import pyglet.gl
+    from pyglet.window import key
+
+    window = pyglet.window.Window(resizable=True, caption='15-Puzzle')
+    maxdimension = min(window.width, window.height)
+
+    try:
+        bgimg = pyglet.resource.image('dodge.png')
+    except Exception:
+        print("No dodge found")
+        bgimg = None
+
+    pyglet.gl.glClearColor(0.1, 0.1, 0.1, 1)
+    panel = Panel()
+
+    window.push_handlers(on_resize, on_draw, on_key_press, on_close)
+    pyglet.clock.schedule_interval(pollSearch, 0.1)
+
+    keys = {
+        key.B:     ('b', "search BFS", lambda:
+                    startSearch(findByName(searches, "BFS"))),
+        key.A:     ('a', "search A*", lambda:
+                    startSearch(findByName(searches, "A*"))),
+        key.I:     ('i', "search IDA*", lambda:
+                    startSearch(findByName(searches, "IDA*"))),
+        key.G:     ('g', "search selected", lambda: startSearch(curSearch)),
+        key.K:     ('k', "cancel search", lambda: cancelSearch()),
+        key.S:     ('s', "change search", lambda: toggleSearch()),
+        key.SPACE: ('␣', "step through solution", lambda: puzzle.step()),
+        key.ENTER: ('↲', "reset puzzle", lambda: puzzle.reset()),
+        key.E:     ('e', "change heur", lambda: toggleHeuristic()),
+        key.H:     ('h', "toggle hint", lambda: toggleHint()),
+        key.R:     ('r', "random", lambda: puzzle.random(0, curHeur)),
+        key.T:     ('t', "random (limit)", lambda: puzzle.random(20, curHeur)),
+        key.Y:     ('y', "switch key directions", lambda: puzzle.twistmoves()),
+        key.X:     ('x', "toggle debug", lambda: toggleDebug()),
+        key.C:     ('c', "toggle profile", lambda: toggleProfile()),
+        key.P:     ('p', "print solution", lambda: puzzle.debugsolution()),
+        key.LEFT:  (None, "move left", lambda: movePuzzle(3)),
+        key.UP:    (None, "move up", lambda: movePuzzle(1)),
+        key.DOWN:  (None, "move down", lambda: movePuzzle(2)),
+        key.RIGHT: (None, "move right", lambda: movePuzzle(0))}
+
+
 def on_resize(width, height):
     global maxdimension
     maxdimension = min(width, height)
@@ -778,11 +2679,7 @@ def on_resize(width, height):
         bgimg.height = maxdimension
 
 
-@window.event
 def on_draw():
-    global puzzle
-    global curHeur
-
     # ---- Background respond to solved state
     if puzzle.solved:
         pyglet.gl.glClearColor(0.1, 0.3, 0.1, 1)
@@ -796,73 +2693,348 @@ def on_draw():
     # ---- Use background image
     if bgimg is not None:
         bgimg.blit(offsetx, offsety)
-        color = (0, 0, 0, 255)
-    else:
-        color = (255, 255, 255, 255)
-
-    # ---- Draw puzzle
-    for y in range(puzzle.dim[1]):
-        for x in range(puzzle.dim[0]):
-            tile = str(puzzle.tile(x, y))
-            size = font_tile
-            if tile == '0':
-                size = int(size * 2)
-                if flag_hint and puzzle.hint is not None:
-                    tile = str(puzzle.hint)
-                else:
-                    tile = '⋅'
-
-            number = pyglet.text.Label(
-                tile, font_size=size, bold=True, color=color,
-                x=offsetx+(x+1)*(maxdimension/(puzzle.dim[0]+1)),
-                y=window.height-offsety-(y+1)*(maxdimension/(puzzle.dim[1]+1)),
-                anchor_x='center', anchor_y='center')
-            number.draw()
-
-    # ---- Construct labels
-    top = window.height - font_large
-    labels = [("Current heuristic function: ", 10, top)]
-    for h in heuristics:
-        prefix = " "
-        if h is curHeur:
-            prefix = "*"
-        y = top - len(labels) * round(1.5 * font_small)
-        text = prefix + " " + str(puzzle.heuristic(h)) + ' ' + h.name
-        labels.append((text, 16, y))
-
-    right = window.width - 180
-    labels.append(("Hint: " + str(flag_hint), right, top))
-    labels.append(("Debug: " + str(flag_debug), right, top - 1.5*font_small))
-    labels.append(("Profile: " + str(flag_profile), right, top - 3*font_small))
-    labels.append(("Solution: " + str(len(puzzle.solution)) + " steps",
-                   right, top - 6*font_small))
-
-    # ---- Draw controls
-    x = line = round(1.5*font_small)
-    for char, desc, func in list(keys.values())[::-1]:
-        if char is not None:
-            labels.append((char+' - '+desc, 20, x))
-            x += line
-    labels.append(("Controls:", 10, x))
-
-    font = 'Monospace'
-    for text, posx, posy in labels:
-        pyglet.text.Label(text, font_name=font, font_size=font_small, x=posx,
-                          y=posy, anchor_x='left', anchor_y='center').draw()
-
-
-@window.event
+
+    panel.update(offsetx, offsety)
+    panel.batch.draw()
+
+
+# Objects of class Panel hold the labels of the window in one batch. The
+# labels are created once and only changed when their text or place does,
+# so a frame costs little more than drawing the batch.
+class Panel(object):
+
+    def __init__(self):
+        self.batch = pyglet.graphics.Batch()
+        self.tiles = []  # a label per index of the board
+        self.labels = []  # heuristics, state of the game and controls
+        self.unavailable = set()  # heuristics failing on this dimension
+
+        return None
+
+    # Give labels[i] text, place and style, create it if needed
+    def set(self, labels, i, text, x, y, **style):
+        if i == len(labels):
+            labels.append(pyglet.text.Label(text, x=x, y=y, batch=self.batch,
+                                            **style))
+            return None
+        label = labels[i]
+        if label.text != text:
+            label.text = text
+        if label.x != x:
+            label.x = x
+        if label.y != y:
+            label.y = y
+        for name, value in style.items():
+            if getattr(label, name) != value:
+                setattr(label, name, value)
+
+    # Drop the labels from index count on
+    def truncate(self, labels, count):
+        for label in labels[count:]:
+            label.delete()
+        del labels[count:]
+
+    # Heuristic value as text, '-' if the heuristic fails on this board
+    # (its tables are too large, see WalkingDistance) or its tables aren't
+    # built yet (the window doesn't wait for that, a search builds them)
+    def cost(self, h):
+        if h.name in self.unavailable:
+            return '-'
+        try:
+            if h.files is not None and \
+                    not all(map(os.path.exists, h.files(puzzle.dim))):
+                return '-'
+            return str(puzzle.heuristic(h))
+        except ValueError:
+            self.unavailable.add(h.name)
+            return '-'
+
+    # Bring the labels up to date
+    def update(self, offsetx, offsety):
+        if bgimg is not None:
+            color = (0, 0, 0, 255)
+        else:
+            color = (255, 255, 255, 255)
+
+        # ---- Puzzle
+        for y in range(puzzle.dim[1]):
+            for x in range(puzzle.dim[0]):
+                tile = str(puzzle.tile(x, y))
+                size = font_tile
+                if tile == '0':
+                    size = int(size * 2)
+                    if flag_hint and puzzle.hint is not None:
+                        tile = str(puzzle.hint)
+                    else:
+                        tile = '⋅'
+
+                self.set(self.tiles, y * puzzle.dim[0] + x, tile,
+                         offsetx+(x+1)*(maxdimension/(puzzle.dim[0]+1)),
+                         window.height-offsety -
+                         (y+1)*(maxdimension/(puzzle.dim[1]+1)),
+                         font_size=size, bold=True, color=color,
+                         anchor_x='center', anchor_y='center')
+
+        # ---- Construct labels
+        top = window.height - font_large
+        labels = [("Current heuristic function: ", 10, top)]
+        for h in heuristics:
+            prefix = " "
+            if h is curHeur:
+                prefix = "*"
+            y = top - len(labels) * round(1.5 * font_small)
+            text = prefix + " " + self.cost(h) + ' ' + h.name
+            labels.append((text, 16, y))
+
+        right = window.width - 180
+        labels.append(("Hint: " + str(flag_hint), right, top))
+        labels.append(("Debug: " + str(flag_debug), right,
+                       top - 1.5*font_small))
+        labels.append(("Profile: " + str(flag_profile), right,
+                       top - 3*font_small))
+        labels.append(("Solution: " + str(len(puzzle.solution)) + " steps",
+                       right, top - 6*font_small))
+        labels.append(("Search: " + curSearch.name, right,
+                       top - 7.5*font_small))
+        if background is not None:
+            labels.append(("Running: " + background.search.name, right,
+                           top - 10.5*font_small))
+            labels.append(("Nodes: " + str(background.expanded), right,
+                           top - 12*font_small))
+            labels.append(("Bound: " + str(background.bound), right,
+                           top - 13.5*font_small))
+            labels.append(("Time: {:.1f}s".format(background.elapsed()),
+                           right, top - 15*font_small))
+            if background.suboptimality is not None:
+                labels.append(("Within: {:.2f}x".format(
+                    background.suboptimality), right, top - 16.5*font_small))
+
+        # ---- Controls
+        x = line = round(1.5*font_small)
+        for char, desc, func in list(keys.values())[::-1]:
+            if char is not None:
+                labels.append((char+' - '+desc, 20, x))
+                x += line
+        labels.append(("Controls:", 10, x))
+
+        for i, (text, posx, posy) in enumerate(labels):
+            self.set(self.labels, i, text, posx, posy,
+                     font_name='Monospace', font_size=font_small,
+                     anchor_x='left', anchor_y='center')
+        self.truncate(self.labels, len(labels))
+
+
 def on_key_press(symbol, modifiers):
     if symbol in keys.keys():
         keys[symbol][2]()
 
 
+# Stop the background search, the window closes after that
+def on_close():
+    cancelSearch()
+
+
+# Objects of class BackgroundSearch run a search on a copy of the board in
+# another process, so the window keeps responding. The process sends
+# ('progress', expanded, bound), ('solution', moves, bound) for every
+# better solution of an anytime search and ('done', solution, complete)
+# through a pipe; poll() reads them.
+class BackgroundSearch(object):
+
+    # Initialize with the board and what to search
+    def __init__(self, board, dim, searchObject, heuristicObject):
+        self.board = board
+        self.dim = dim
+        self.search = searchObject
+        self.heuristic = heuristicObject
+
+        self.expanded = 0
+        self.bound = None
+        self.solution = None  # best solution so far (anytime searches)
+        self.suboptimality = None  # of that solution
+        self.done = False
+        self.replan = False  # started by a move, see movePuzzle
+
+        return None
+
+    # Start the process
+    def start(self, _debug=False, _profile=False):
+        self.receiver, sender = multiprocessing.Pipe(False)
+        self.process = multiprocessing.Process(
+            target=backgroundChild,
+            args=(sender, self.board, self.dim, self.search.name,
+                  self.heuristic.name, _debug, _profile, tt_budget,
+                  perimeter_depth))
+        self.tstart = timer()
+        self.process.start()
+        sender.close()
+
+    def elapsed(self):
+        return timer() - self.tstart
+
+    # Read the messages so far, return new solutions as (moves, board)
+    def poll(self):
+        solutions = []
+        try:
+            while not self.done and self.receiver.poll():
+                message = self.receiver.recv()
+                if message[0] == 'progress':
+                    self.expanded, self.bound = message[1:]
+                elif message[0] == 'solution':
+                    self.solution = (message[1], self.board)
+                    self.suboptimality = message[2]
+                    solutions.append(self.solution)
+                else:
+                    self.done = True
+                    if message[1] is not None:
+                        self.solution = message[1]
+                        self.store(message[2])
+                        solutions.append(self.solution)
+        except EOFError:
+            print("\nThe search failed.")
+            self.done = True
+        if self.done:
+            self.process.join()
+        return solutions
+
+    # Remember the solution in the solution cache
+    def store(self, complete):
+        cache = getSolutionCache()
+        if cache is not None:
+            cache.store(self.board, self.dim, self.solution[0], self.search,
+                        self.heuristic, complete)
+
+    # Stop the process (and its workers, where there are process groups)
+    def cancel(self):
+        try:
+            os.killpg(self.process.pid, 9)
+        except (AttributeError, ProcessLookupError):  # no killpg on Windows
+            self.process.kill()
+        self.process.join()
+        self.done = True
+
+
+# Run a search for BackgroundSearch (in its process). The options set on
+# the command line are passed along, spawned processes (the default on
+# Windows and macOS) don't inherit them. The search stops by itself when
+# the GUI is gone without cancelling it (killed).
+def backgroundChild(connection, board, dim, searchName, heuristicName,
+                    debug, profile, ttBudget, perimeterDepth):
+    global tt_budget, perimeter_depth
+    tt_budget, perimeter_depth = ttBudget, perimeterDepth
+    if hasattr(os, 'setpgrp'):
+        os.setpgrp()  # cancel kills the whole group, workers included
+    searchObject = findByName(makeSearches(), searchName)
+    heuristicObject = findByName(makeHeuristics(), heuristicName)
+    parent = os.getppid()
+
+    def report(metrics):
+        if os.getppid() != parent:
+            raise SearchStopped("the GUI is gone")
+        connection.send(('progress', metrics.expanded, metrics.bound))
+    addProgressHook(report, 10000)
+
+    goal = Puzzle(*dim).initcopy()
+    try:
+        if searchObject.function is araSearch and not profile:
+            solution = None
+            for moves, start, bound in araSolutions(board, goal, dim,
+                                                    heuristicObject):
+                solution = (moves, start)
+                connection.send(('solution', moves, bound))
+        else:
+            solution = searchObject.run(board, goal, dim, heuristicObject,
+                                        debug, profile)
+    except SearchStopped:
+        return None
+    connection.send(('done', solution, True))
+
+
+# Solve the puzzle in the background, a search still running is cancelled
+# (_replan: started by a move, see movePuzzle)
+def startSearch(searchObject, _replan=False):
+    global background, planSearch
+    cancelSearch()
+    planSearch = searchObject
+
+    solution = None if flag_profile else puzzle.cached(searchObject,
+                                                       curHeur)
+    if solution is not None:
+        puzzle.solve(solution)
+        return None
+
+    background = BackgroundSearch(puzzle.boardcopy(), puzzle.dim,
+                                  searchObject, curHeur)
+    background.replan = _replan
+    background.start(flag_debug, flag_profile)
+    # multiprocessing waits for its processes at exit (registered when the
+    # first one starts), the search has to be cancelled before that
+    atexit.unregister(cancelSearch)
+    atexit.register(cancelSearch)
+
+
+# Cancel the background search, keep its best solution so far
+def cancelSearch():
+    global background
+    if background is not None:
+        background.cancel()
+        print("\nSearch cancelled after {:.1f}s.".format(
+            background.elapsed()))
+        if background.solution is not None:
+            background.store(False)
+        background = None
+
+
+# Take the news of the background search (scheduled by initGUI)
+def pollSearch(dt):
+    global background
+    if background is None:
+        return None
+
+    for solution in background.poll():
+        if puzzle.board == solution[1]:  # the board wasn't moved meanwhile
+            puzzle.solve(solution)
+    if background.done:
+        background = None
+
+
+# Move the empty tile. A replanned hint (see Puzzle.move) is shown at once
+# and a search looks for a better one in the background, see replanSearch.
+# The search for the hint of the board before is cancelled, its solution
+# would be of no use anymore.
+def movePuzzle(direction):
+    puzzle.move(direction)
+    if background is not None and background.replan:
+        cancelSearch()
+    searchObject = replanSearch()
+    if puzzle.replanned and flag_hint and searchObject is not None:
+        startSearch(searchObject, _replan=True)
+
+
+# Return the search to improve a replanned hint: the search of the plan if
+# its memory is bounded, IDA* (in-place) else (an idle player must not be
+# left with a search that fills the memory). None if the plan came from a
+# search that isn't optimal.
+def replanSearch():
+    if planSearch is None or not planSearch.optimal:
+        return None
+    if planSearch.bounded:
+        return planSearch
+    return findByName(searches, "IDA* (in-place)")
+
+
 def toggleHeuristic():
     global curHeur, heuristics
     new_index = (heuristics.index(curHeur)+1) % len(heuristics)
     curHeur = heuristics[new_index]
 
 
+def toggleSearch():
+    global curSearch, searches
+    new_index = (searches.index(curSearch)+1) % len(searches)
+    curSearch = searches[new_index]
+
+
 def toggleDebug():
     global flag_debug
     flag_debug = not flag_debug
@@ -878,76 +3050,988 @@ def toggleHint():
     flag_hint = not flag_hint
 
 
-# ######################## Main function
+# ######################## Solution cache
 
-def main():
-    global puzzle, searches, curSearch, heuristics, curHeur, keys
+# Reflect a board at its main diagonal (square boards only). Tiles are
+# renumbered, so the solved board stays solved; move m becomes
+# reflectMoves[m].
+def reflectBoard(board, dim):
+    side = dim[0]
+    reflected = [0] * len(board)
+    for i, tile in enumerate(board):
+        row, col = divmod(i, side)
+        if tile != 0:
+            goalrow, goalcol = divmod(tile - 1, side)
+            tile = goalcol * side + goalrow + 1
+        reflected[col * side + row] = tile
+    return reflected
 
-    if len(sys.argv) == 1:
-        puzzle = Puzzle(4, 4)
-    elif len(sys.argv) == 2:
-        board = []
-        given = sys.argv[1].replace(' ', '').split(',')
-        for tile in given:
-            tile = int(tile)
-            if tile in board or tile < 0 or tile > len(given):
-                print("Error reading input!")
-                sys.exit(0)
-            board.append(tile)
-        if 0 not in board:
-            print("Error reading input! no zero")
-            sys.exit(0)
-        y = int(math.sqrt(len(board)))
-        while y > 0:
-            if len(board) % y != 0:
-                y -= 1
+
+reflectMoves = str.maketrans('0123', '2301')
+
+
+# Objects of class SolutionCache remember the solutions of boards
+#
+# A board and its reflection share one entry (the smaller packed state is
+# the key). Entries know the search and heuristic that found them; an
+# entry is only replaced by a shorter solution, or by an optimal one of the
+# same length. The least recently used entries are dropped beyond size.
+# Entries are appended to a file as JSON lines and read again by load();
+# the file is rewritten when it has twice as many lines as entries.
+# Entries of an older solution_version (A* could return too long solutions
+# with the pattern database then) don't count as optimal.
+class SolutionCache(object):
+
+    # Initialize with the file of the cache and the max. number of entries
+    def __init__(self, filename, _size=100000):
+        self.filename = filename
+        self.size = _size
+        self.entries = OrderedDict()  # (dim, state) -> entry dict
+        self.lines = 0
+        self.writable = True  # False after the file couldn't be written
+
+        return None
+
+    # Return key of a board and whether the key is the reflected board
+    def key(self, board, dim):
+        state = packState(board, dim)
+        if dim[0] == dim[1]:
+            reflected = packState(reflectBoard(board, dim), dim)
+            if reflected < state:
+                return (dim, reflected), True
+        return (dim, state), False
+
+    # Add an entry unless the cache knows a better one: a shorter solution
+    # always wins (an optimal one can't be longer), on a tie the optimal one
+    def add(self, key, entry):
+        old = self.entries.get(key)
+        if old is not None and (
+                len(old['solution']) < len(entry['solution']) or (
+                    len(old['solution']) == len(entry['solution']) and
+                    (old['optimal'] or not entry['optimal']))):
+            return False
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+        return True
+
+    # Read the file (if there is one), broken lines are skipped
+    def load(self):
+        self.entries.clear()
+        self.lines = 0
+        if not os.path.exists(self.filename):
+            return None
+        try:
+            with open(self.filename) as f:
+                for line in f:
+                    self.lines += 1
+                    try:
+                        entry = json.loads(line)
+                        key = (tuple(entry.pop('dim')), entry.pop('state'))
+                    except (ValueError, KeyError, TypeError):
+                        continue
+                    if entry.pop('version', 1) < solution_version:
+                        entry['optimal'] = False
+                    self.add(key, entry)
+        except OSError as e:
+            self.fail(e)
+
+    # Keep going without the file after an error, warn only once
+    def fail(self, error):
+        if self.writable:
+            print("Solution cache disabled: " + str(error), file=sys.stderr)
+        self.writable = False
+
+    # Write all entries to a new file. Other processes may lose what they
+    # append meanwhile, that is fine for a cache.
+    def compact(self):
+        replaceFile(self.filename, lambda f: f.writelines(
+            self.line(key, entry) for key, entry in self.entries.items()))
+        self.lines = len(self.entries)
+
+    def line(self, key, entry):
+        return json.dumps(dict(entry, dim=key[0], state=key[1],
+                               version=solution_version)) + '\n'
+
+    # Return the entry for a board (solution for this board, search,
+    # heuristic, optimal) or None. A suboptimal entry only counts for the
+    # search and heuristic which found it.
+    def lookup(self, board, dim, searchObject, heuristicObject):
+        key, reflected = self.key(board, dim)
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if not entry['optimal'] and (
+                entry['search'] != searchObject.name or
+                entry['heuristic'] != heuristicObject.name):
+            return None
+
+        self.entries.move_to_end(key)
+        entry = dict(entry)
+        if reflected:
+            entry['solution'] = entry['solution'].translate(reflectMoves)
+        return entry
+
+    # Remember the solution of a board, _complete is False for anytime
+    # searches that were stopped early
+    def store(self, board, dim, solution, searchObject, heuristicObject,
+              _complete=True):
+        key, reflected = self.key(board, dim)
+        if reflected:
+            solution = solution.translate(reflectMoves)
+        optimal = searchObject.optimal and heuristicObject.admissible and \
+            _complete
+        entry = {'solution': solution,
+                 'search': searchObject.name,
+                 'heuristic': heuristicObject.name,
+                 'optimal': optimal}
+        if not self.add(key, entry) or not self.writable:
+            return None
+
+        try:
+            if self.lines >= 2 * self.size:
+                self.compact()
             else:
-                break
-        puzzle = Puzzle(len(board)//y, y)
-        puzzle.update(board)
+                os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+                with open(self.filename, 'a') as f:
+                    f.write(self.line(key, entry))
+                self.lines += 1
+        except OSError as e:
+            self.fail(e)
+
+
+# Return the solution cache (loaded on first use), None if it is off
+def getSolutionCache():
+    global solution_cache
+    if not flag_cache:
+        return None
+    if solution_cache is None:
+        solution_cache = SolutionCache(os.path.join(cachedir,
+                                                    'solutions.jsonl'))
+        solution_cache.load()
+    return solution_cache
+
+
+# ######################## Board generators
+
+# Is a board solvable? Every move swaps the empty tile with a neighbor: it
+# changes the parity of the permutation (empty tile included) and of the
+# empty tile's distance to its goal. So both parities have to be equal.
+# The permutation parity comes from its cycles, in linear time.
+def isSolvable(board, dim):
+    cells = dim[0] * dim[1]
+    seen = [False] * cells
+    transpositions = 0
+    for index in range(cells):
+        length = 0
+        while not seen[index]:
+            seen[index] = True
+            index = (board[index] - 1) % cells  # goal index of the tile
+            length += 1
+        transpositions += max(length - 1, 0)
+
+    row, col = divmod(board.index(0), dim[0])
+    distance = (dim[1] - 1 - row) + (dim[0] - 1 - col)
+    return transpositions % 2 == distance % 2
+
+
+# Return a uniformly random solvable board: half of the shuffled boards
+# aren't solvable, swapping tiles 1 and 2 turns them into the other half
+def randomBoard(dim, _rnd=random):
+    board = Puzzle(*dim).initcopy()
+    _rnd.shuffle(board)
+    if not isSolvable(board, dim):
+        one, two = board.index(1), board.index(2)
+        board[one], board[two] = 2, 1
+    return board
+
+
+# Return count uniformly random solvable boards (2-D numpy array, a board
+# per row, or a list of boards without numpy), see randomBoard
+def randomBoards(dim, count, _rnd=random):
+    try:
+        import numpy  # INSTALL
+    except ImportError:
+        return [randomBoard(dim, _rnd) for i in range(count)]
+
+    cells = dim[0] * dim[1]
+    generator = numpy.random.default_rng(_rnd.getrandbits(64))
+    boards = numpy.argsort(generator.random((count, cells)), axis=1)
+
+    # permutation parity from the inversions, empty tile numbered last
+    tiles = numpy.where(boards == 0, cells, boards)
+    before = numpy.triu(numpy.ones((cells, cells), dtype=bool), 1)
+    inversions = ((tiles[:, :, None] > tiles[:, None, :]) & before).sum(
+        axis=(1, 2))
+    row, col = numpy.divmod(numpy.argmax(boards == 0, axis=1), dim[0])
+    distance = (dim[1] - 1 - row) + (dim[0] - 1 - col)
+
+    unsolvable = numpy.flatnonzero((inversions + distance) % 2)
+    one = numpy.argmax(boards[unsolvable] == 1, axis=1)
+    two = numpy.argmax(boards[unsolvable] == 2, axis=1)
+    boards[unsolvable, one] = 2
+    boards[unsolvable, two] = 1
+    return boards
+
+
+# Return the board after a random walk of length moves from the solved
+# board (never taking back the last move)
+def randomWalk(dim, length, rnd):
+    bits = stateBits(dim)
+    table = moveTable(dim)
+    board = Puzzle(*dim).initcopy()
+    state, izero = packState(board, dim), board.index(0)
+    lastmove = -1
+    for i in range(length):
+        lastmove, state, izero, tile = rnd.choice(list(
+            packedChildren(state, izero, lastmove, table, bits)))
+    return unpackState(state, dim)
+
+
+# Return the boards of a dimension by their optimal distance to the goal
+# (a list of lists of packed states), found by a breadth first search from
+# the goal. They are built once and kept in memory, so only dimensions
+# with up to distance_budget boards are supported.
+def distanceLayers(dim):
+    if dim in distance_layers:
+        return distance_layers[dim]
+
+    if math.factorial(dim[0] * dim[1]) // 2 > distance_budget:
+        raise ValueError("No exact distances for {}x{} boards, use a "
+                         "heuristic band or random walks".format(*dim))
+
+    bits = stateBits(dim)
+    table = moveTable(dim)
+    goal = Puzzle(*dim).initcopy()
+    frontier = [(packState(goal, dim), goal.index(0))]
+    seen = set(state for state, izero in frontier)
+    layers = []
+    while frontier:
+        layers.append([state for state, izero in frontier])
+        successors = []
+        for state, izero in frontier:
+            for move, new, iswap, tile in packedChildren(state, izero, -1,
+                                                         table, bits):
+                if new not in seen:
+                    seen.add(new)
+                    successors.append((new, iswap))
+        frontier = successors
+
+    distance_layers[dim] = layers
+    return layers
+
+
+# Stream solvable boards (endless generator). Bounds are inclusive:
+# _distance=(low, high) gives boards with an optimal solution of that
+# length (small boards only, see distanceLayers), _walk=(low, high) random
+# walks of that many moves and _band=(low, high) random boards rated in
+# that band by _heuristic. Without any of them the boards are uniformly
+# random. Bands far below the ratings of random boards are rarely hit,
+# random walks suit them better.
+def generateBoards(dim, _distance=None, _walk=None, _band=None,
+                   _heuristic=None, _rnd=random, _chunk=1000):
+    if _distance is not None:
+        layers = distanceLayers(dim)[_distance[0]:_distance[1] + 1]
+        if not layers:
+            raise ValueError("No {}x{} boards at distance {}-{}".format(
+                dim[0], dim[1], *_distance))
+        sizes = [len(layer) for layer in layers]
+        while True:
+            layer = _rnd.choices(layers, sizes)[0]
+            yield unpackState(_rnd.choice(layer), dim)
+
+    if _walk is not None:
+        while True:
+            yield randomWalk(dim, _rnd.randint(*_walk), _rnd)
+
+    while True:
+        boards = randomBoards(dim, _chunk, _rnd)
+        if _band is None:
+            costs = [_band] * len(boards)
+        else:
+            costs = _heuristic.runBatch(boards, dim)
+        for board, cost in zip(boards, costs):
+            if _band is None or _band[0] <= cost <= _band[1]:
+                yield [int(tile) for tile in board]
+
+
+# Parse a range of numbers given as 'low-high' (or a single number) for
+# argparse, return (low, high)
+def parseRange(text):
+    try:
+        bounds = [int(bound) for bound in text.split('-')]
+    except ValueError:
+        bounds = []
+    if len(bounds) not in (1, 2) or not 0 <= bounds[0] <= bounds[-1]:
+        raise argparse.ArgumentTypeError("Expected LOW-HIGH, got " + text)
+    return bounds[0], bounds[-1]
+
+
+# Parse a dimension given as 'WxH' for argparse
+def parseDimension(text):
+    try:
+        dim = tuple(int(size) for size in text.lower().split('x'))
+    except ValueError:
+        dim = ()
+    if len(dim) != 2 or min(dim) < 2:
+        raise argparse.ArgumentTypeError("Expected WxH, got " + text)
+    return dim
+
+
+# ######################## Batch mode
+
+# Parse a board given as comma separated tiles, return board and dimension
+def parseBoard(text):
+    board = []
+    given = text.replace(' ', '').split(',')
+    for tile in given:
+        try:
+            tile = int(tile)
+        except ValueError:
+            raise ValueError("Error reading input!")
+        board.append(tile)
+    if sorted(board) != list(range(len(board))):
+        raise ValueError("Error reading input! expected the tiles 0 to " +
+                         str(len(board) - 1))
+    y = int(math.sqrt(len(board)))
+    while y > 0:
+        if len(board) % y != 0:
+            y -= 1
+        else:
+            break
+    if y < 2:
+        raise ValueError("Error reading input! " + str(len(board)) +
+                         " tiles don't make a board")
+    return board, (len(board)//y, y)
+
+
+# Solve a single board, return the result as a dict
+def solveBoard(board, dim, searchObject, heuristicObject, _cache=None):
+    game = Puzzle(*dim)
+    game.update(board)
+
+    result = {'board': board,
+              'search': searchObject.name,
+              'heuristic': heuristicObject.name}
+
+    if not game.solvable:
+        result['error'] = "not solvable"
+        return result
+
+    if _cache is not None:
+        entry = _cache.lookup(board, dim, searchObject, heuristicObject)
+        if entry is not None:
+            result['solution'] = entry['solution']
+            result['length'] = len(entry['solution'])
+            result['cached'] = {'search': entry['search'],
+                                'heuristic': entry['heuristic']}
+            return result
+
+    tstart = timer()
+    try:
+        solution = searchObject.execute(game.boardcopy(), game.initcopy(),
+                                        dim, heuristicObject)
+    except SearchStopped as e:
+        solution = None
+        result['error'] = str(e) or "search stopped"
+    except ValueError as e:  # tables too large, unsupported goal, ...
+        solution = None
+        result['error'] = str(e)
+    result['time'] = timer() - tstart
+
+    if solution is not None:
+        result['solution'] = solution[0]
+        result['length'] = len(solution[0])
+    elif 'error' not in result:
+        result['error'] = "no solution found"
+    result.update(metrics.asdict())
+
+    if _cache is not None and solution is not None:
+        _cache.store(board, dim, solution[0], searchObject, heuristicObject,
+                     metrics.suboptimality in (None, 1))
+    return result
+
+
+# Solve a board given as line of text or as (board, dim) tuple
+def solveItem(item, searchObject, heuristicObject, _cache=None):
+    if isinstance(item, str):
+        try:
+            board, dim = parseBoard(item)
+        except ValueError as e:
+            return {'board': item, 'error': str(e)}
+    else:
+        board, dim = item
+    return solveBoard(board, dim, searchObject, heuristicObject, _cache)
+
+
+# Worker processes look up search and heuristic once and load the lookup
+# tables of the given dimensions (already built and mapped by the parent).
+# Each one reads the solution cache (if on) and appends to its file.
+def initWorker(searchName, heuristicName, dims, _cached=False,
+               _timelimit=None):
+    global worker_search, worker_heuristic, worker_cache
+    worker_search = findByName(makeSearches(), searchName)
+    worker_heuristic = findByName(makeHeuristics(), heuristicName)
+    for dim in dims:
+        worker_heuristic.evaluator(dim)
+    worker_cache = getSolutionCache() if _cached else None
+    if _timelimit is not None:
+        addTimeLimit(_timelimit)
+
+
+# Solve a chunk of boards in a worker process
+def solveChunk(chunk):
+    return [solveItem(item, worker_search, worker_heuristic, worker_cache)
+            for item in chunk]
+
+
+# Solve boards (lines of text or (board, dim) tuples) in a process pool
+#
+# Yields the results in input order, or as they complete if not _ordered.
+# Only a few chunks per process are in flight at any time, so the input
+# may be an endless iterator. Tables for the heuristic are prepared for
+# all _dims before the workers start, workers build the tables of other
+# dimensions themselves.
+def solveBatch(boards, searchName, heuristicName, _processes=None,
+               _ordered=True, _chunksize=8, _dims=(), _cached=False,
+               _timelimit=None):
+    processes = _processes or os.cpu_count()
+    findByName(makeSearches(), searchName)
+    heuristicObject = findByName(makeHeuristics(), heuristicName)
+    dims = []
+    for dim in _dims:
+        try:
+            heuristicObject.evaluator(dim)
+        except ValueError:  # tables too large, the boards report it
+            continue
+        dims.append(dim)
+
+    pending = deque()
+    done = Queue()  # completed chunks, if not ordered
+
+    # Wait for the next chunk of results
+    def collect():
+        if _ordered:
+            return pending.popleft().get()
+        pending.popleft()
+        chunk = done.get()
+        if isinstance(chunk, BaseException):
+            raise chunk
+        return chunk
+
+    with multiprocessing.Pool(processes, initWorker,
+                              (searchName, heuristicName, dims,
+                               _cached, _timelimit)) as pool:
+        chunk = []
+        for item in boards:
+            chunk.append(item)
+            if len(chunk) < _chunksize:
+                continue
+
+            pending.append(pool.apply_async(
+                solveChunk, (chunk,),
+                callback=None if _ordered else done.put,
+                error_callback=None if _ordered else done.put))
+            chunk = []
+
+            while len(pending) >= 4 * processes:
+                for result in collect():
+                    yield result
+
+        if chunk:
+            pending.append(pool.apply_async(
+                solveChunk, (chunk,),
+                callback=None if _ordered else done.put,
+                error_callback=None if _ordered else done.put))
+
+        while pending:
+            for result in collect():
+                yield result
+
+
+# Solve boards read line by line, write a JSON line per board
+#
+# Searches are stopped after _timelimit seconds, anytime searches then
+# return their best solution so far. With several _jobs the first chunk of
+# every job is read ahead, the tables are prepared for the dimensions of
+# its boards.
+def runBatch(infile, outfile, searchObject, heuristicObject, _jobs=1,
+             _ordered=True, _timelimit=None, _chunksize=8):
+    lines = (line.strip() for line in infile)
+    lines = (line for line in lines
+             if line != '' and not line.startswith('#'))
+
+    if _jobs > 1:
+        ahead = list(islice(lines, _jobs * _chunksize))
+        dims = set()
+        for line in ahead:
+            try:
+                dims.add(parseBoard(line)[1])
+            except ValueError:
+                pass
+        results = solveBatch(chain(ahead, lines), searchObject.name,
+                             heuristicObject.name, _jobs, _ordered,
+                             _chunksize, tuple(sorted(dims)),
+                             _cached=flag_cache, _timelimit=_timelimit)
+    else:
+        if _timelimit is not None:
+            addTimeLimit(_timelimit)
+        cache = getSolutionCache()
+        results = (solveItem(line, searchObject, heuristicObject, cache)
+                   for line in lines)
+
+    for result in results:
+        outfile.write(json.dumps(result) + '\n')
+        outfile.flush()
+
+
+# Find a search or heuristic by (case insensitive) name
+def findByName(objects, name):
+    for obj in objects:
+        if obj.name.lower() == name.lower():
+            return obj
+    raise ValueError("Unknown name '" + name + "', choose from: " +
+                     ', '.join("'" + obj.name + "'" for obj in objects))
+
+
+# ######################## Benchmarks
+
+# The fixed benchmark boards as (name, board, dim): random walks of graded
+# length on 3x3 and 4x4, random 3x3 boards, walks on boards that aren't
+# square, boards of fixed bugs and Korf's 100 instances (korffile). The
+# same _seed always gives the same boards.
+def benchmarkBoards(_seed=2017):
+    rnd = random.Random(_seed)
+    instances = []
+    for dim, lengths, count in (((3, 3), (10, 20, 30, 40), 3),
+                                ((4, 4), (20, 40, 60, 80), 3),
+                                ((4, 3), (30,), 2),
+                                ((3, 4), (30,), 2),
+                                ((5, 2), (30,), 2),
+                                ((2, 5), (30,), 2)):
+        for length in lengths:
+            for i in range(count):
+                name = "{}x{}-walk{}-{}".format(dim[0], dim[1], length, i + 1)
+                instances.append((name, randomWalk(dim, length, rnd), dim))
+
+    game = Puzzle(3, 3)
+    for i in range(3):
+        board = game.initcopy()
+        game.solvable = False
+        while not game.solvable:
+            rnd.shuffle(board)
+            game.update(board)
+        instances.append(("3x3-random-" + str(i + 1), board, (3, 3)))
+
+    # A* took 34 moves with the pattern database before it reopened states,
+    # the optimal solution has 32
+    instances.append(("4x4-reopen", [6, 3, 0, 12, 1, 13, 8, 4, 5, 9, 2, 7,
+                                     10, 14, 11, 15], (4, 4)))
+
+    with open(korffile) as infile:
+        instances += readKorfBoards(infile)
+    return instances
+
+
+# Read square boards in the format of Korf's 100 instances: an optional
+# number, then the tiles row by row. The goal there has the empty tile
+# first; turning a board by 180 degrees and numbering the tiles backwards
+# gives the same puzzle with our goal.
+def readKorfBoards(infile):
+    instances = []
+    for line in infile:
+        if line.strip() == '' or line.startswith('#'):
+            continue
+        try:
+            numbers = [int(number) for number in line.split()]
+        except ValueError:
+            raise ValueError("Error reading Korf instance: " + line.strip())
+        side = int(math.sqrt(len(numbers)))
+        if side * side == len(numbers):
+            index, tiles = len(instances) + 1, numbers
+        else:
+            index, tiles = numbers[0], numbers[1:]
+            side = int(math.sqrt(len(tiles)))
+        if side * side != len(tiles) or sorted(tiles) != list(range(side**2)):
+            raise ValueError("Error reading Korf instance: " + line.strip())
+
+        board = [(len(tiles) - tile) % len(tiles) for tile in reversed(tiles)]
+        instances.append(("korf-" + str(index), board, (side, side)))
+    return instances
+
+
+# Solve a board in a benchmark process (see benchmarkRun) and send the
+# result with the peak memory use of the process (KiB)
+def benchmarkChild(connection, board, dim, searchName, heuristicName,
+                   memory_budget, nodes):
+    import resource
+
+    os.setpgrp()  # the parent kills the whole group, workers included
+    if memory_budget is not None:
+        limit = memory_budget << 20
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    if nodes is not None:
+        def stop(metrics):
+            raise SearchStopped("node budget exceeded")
+        addProgressHook(stop, nodes)
+
+    searchObject = findByName(makeSearches(), searchName)
+    heuristicObject = findByName(makeHeuristics(), heuristicName)
+    try:
+        result = solveBoard(board, dim, searchObject, heuristicObject)
+    except MemoryError:
+        result = {'error': "memory budget exceeded"}
+    result.pop('process_peak_memory', None)
+    result['memory'] = metrics.memory()  # the process ran this search only
+    connection.send(result)
+
+
+# Run a search on a benchmark instance in its own process, return the
+# result as a dict
+#
+# budgets is (seconds, MiB, expanded nodes), any of them may be None. The
+# process is killed when the time is up.
+def benchmarkRun(instance, searchName, heuristicName, budgets):
+    name, board, dim = instance
+    time_budget, memory_budget, nodes = budgets
+    record = {'instance': name, 'dim': list(dim)}
+
+    receiver, sender = multiprocessing.Pipe(False)
+    process = multiprocessing.Process(
+        target=benchmarkChild,
+        args=(sender, board, dim, searchName, heuristicName,
+              memory_budget, nodes))
+    tstart = timer()
+    process.start()
+    sender.close()
+
+    if receiver.poll(time_budget):
+        try:
+            record.update(receiver.recv())
+        except EOFError:
+            pass  # the process died, see below
     else:
-        print("Unable to parse given data")
-
-    heuristics = [Heuristic("Misplaced Tiles", hCostMpt),
-                  Heuristic("Tiles out of row & column", hCostToorac),
-                  Heuristic("Manhattan Distance", hCostManhattan),
-                  Heuristic("Linear Conflicts", hCostLinearConflict),
-                  Heuristic("LC * 1.1", hCostLC1_1x),
-                  Heuristic("LC * 1.5", hCostLC1_5x),
-                  Heuristic("LC * 2", hCostLC2x),
-                  Heuristic("LC * 3", hCostLC3x)]
+        record['error'] = "time budget exceeded"
+        record['time'] = timer() - tstart
+        try:
+            os.killpg(process.pid, 9)
+        except ProcessLookupError:
+            process.kill()
+    process.join()
+    receiver.close()
+
+    record.setdefault('board', board)
+    record.setdefault('search', searchName)
+    record.setdefault('heuristic', heuristicName)
+    if 'error' not in record and 'length' not in record:
+        record['error'] = "crashed (exit code " + str(process.exitcode) + ")"
+    return record
+
+
+# Run every search with every heuristic on the instances, write a JSON
+# line per run (and a short note to stderr)
+def runBenchmark(outfile, instances, searchNames, heuristicNames, budgets):
+    # tables are built once here, not in the time budget of a run
+    dims = sorted(set(dim for name, board, dim in instances))
+    for heuristicName in heuristicNames:
+        heuristicObject = findByName(makeHeuristics(), heuristicName)
+        for dim in dims:
+            heuristicObject.evaluator(dim)
+
+    for searchName in searchNames:
+        for heuristicName in heuristicNames:
+            for instance in instances:
+                result = benchmarkRun(instance, searchName, heuristicName,
+                                      budgets)
+                outfile.write(json.dumps(result) + '\n')
+                outfile.flush()
+
+                note = result.get('error')
+                if note is None:
+                    note = "{} moves, {:.3f}s, {} nodes".format(
+                        result['length'], result['time'],
+                        result['expanded'])
+                print(" / ".join((instance[0], searchName, heuristicName)) +
+                      ": " + note, file=sys.stderr)
+
+
+# Read a results file of runBenchmark, keyed by instance, search and
+# heuristic
+def readResults(infile):
+    results = {}
+    for line in infile:
+        if line.strip() != '':
+            result = json.loads(line)
+            results[(result['instance'], result['search'],
+                     result['heuristic'])] = result
+    return results
+
+
+# Print the runs which differ between two results files by more than
+# _tolerance (relative), return the number of regressions
+#
+# Differences in time below 10ms are ignored, they are mostly noise.
+def compareResults(oldfile, newfile, _tolerance=0.1):
+    old, new = readResults(oldfile), readResults(newfile)
+    regressions = 0
+
+    for key in sorted(set(old) & set(new)):
+        before, after = old[key], new[key]
+        notes = []  # (worse?, text)
+
+        if before['board'] != after['board']:
+            notes.append((True, "different board"))
+        elif 'error' in after and 'error' not in before:
+            notes.append((True, "fails: " + after['error']))
+        elif 'error' in before and 'error' not in after:
+            notes.append((False, "solved now"))
+        elif 'error' not in after:
+            if before['length'] != after['length']:
+                notes.append((after['length'] > before['length'],
+                              "length {} -> {}".format(before['length'],
+                                                       after['length'])))
+            for field in ('time', 'expanded', 'generated', 'pruned',
+                          'heuristic_calls', 'peak_frontier', 'memory'):
+                a, b = before.get(field), after.get(field)
+                if not a or b is None:
+                    continue
+                if field == 'time' and abs(b - a) < 0.01:
+                    continue
+                change = (b - a) / a
+                if abs(change) > _tolerance:
+                    if field == 'time':
+                        a, b = "{:.3f}s".format(a), "{:.3f}s".format(b)
+                    notes.append((change > 0, "{} {:+.0%} ({} -> {})"
+                                  .format(field, change, a, b)))
+
+        if notes:
+            worse = any(note[0] for note in notes)
+            regressions += worse
+            print(("REGRESSION " if worse else "improved   ") +
+                  " / ".join(key) + ": " +
+                  ", ".join(note[1] for note in notes))
+
+    for results, other, text in ((old, new, "only in old results"),
+                                 (new, old, "only in new results")):
+        missing = len(set(results) - set(other))
+        if missing:
+            print(str(missing) + " runs " + text)
+    print(str(regressions) + " regressions")
+    return regressions
+
+
+# ######################## Main function
+
+# All available heuristics
+def makeHeuristics():
+    return [Heuristic("Misplaced Tiles", hCostMpt, MptEvaluator,
+                      _batch=hBatchMpt),
+            Heuristic("Tiles out of row & column", hCostToorac,
+                      TooracEvaluator, _batch=hBatchToorac),
+            Heuristic("Manhattan Distance", hCostManhattan,
+                      ManhattanEvaluator, _batch=hBatchManhattan),
+            # counts every pair in the wrong order, which may overestimate
+            Heuristic("Linear Conflicts", hCostLinearConflict,
+                      LinearConflictEvaluator, _batch=hBatchLinearConflict,
+                      _admissible=False),
+            Heuristic("LC * 1.1", hCostLC1_1x, LinearConflictEvaluator, 1.1,
+                      hBatchLinearConflict, _admissible=False),
+            Heuristic("LC * 1.5", hCostLC1_5x, LinearConflictEvaluator, 1.5,
+                      hBatchLinearConflict, _admissible=False),
+            Heuristic("LC * 2", hCostLC2x, LinearConflictEvaluator, 2,
+                      hBatchLinearConflict, _admissible=False),
+            Heuristic("LC * 3", hCostLC3x, LinearConflictEvaluator, 3,
+                      hBatchLinearConflict, _admissible=False),
+            Heuristic("Walking Distance", hCostWalking, WalkingEvaluator,
+                      _files=walkingFiles),
+            # admissible, but not consistent (see PatternDatabase)
+            Heuristic("Pattern Database", hCostPattern, PatternEvaluator,
+                      _files=patternFiles)]
+
+
+# All available searches
+def makeSearches():
+    return [Search("BFS", Queue),
+            Search("A*", BucketQueue),
+            Search("Bidirectional BFS", _function=bidirectionalSearch),
+            Search("Bidirectional A* (MM)", _function=mmSearch),
+            Search("ARA*", _function=araSearch),
+            Search("IDA*", None, _bounded=True),
+            Search("IDA* (in-place)", _function=idaInplaceSearch,
+                   _bounded=True),
+            Search("IDA* (TT)", _function=idaTableSearch, _bounded=True),
+            Search("IDA* (perimeter)", _function=perimeterSearch,
+                   _bounded=True),
+            Search("IDA* (parallel)", _function=idaParallelSearch,
+                   _bounded=True),
+            Search("Macro (rows/columns)", _function=macroSearch,
+                   _optimal=False, _bounded=True)]
+
+
+def parseArguments():
+    parser = argparse.ArgumentParser(
+        description="The classic 15-puzzle with yellow dogs.")
+    parser.add_argument('board', nargs='?',
+                        help="comma separated tiles, 0 is the empty tile")
+    parser.add_argument('--batch', metavar='FILE', nargs='?', const='-',
+                        help="solve boards (one per line) from FILE or " +
+                        "stdin without GUI, write JSON lines to stdout")
+    parser.add_argument('--search',
+                        help="search for batch mode (default: IDA* " +
+                        "(in-place)) or benchmarks (default: all)")
+    parser.add_argument('--heuristic',
+                        help="heuristic for batch mode (default: " +
+                        "Manhattan Distance) or benchmarks (default: all)")
+    parser.add_argument('--jobs', type=int, default=1,
+                        help="number of processes for batch mode")
+    parser.add_argument('--unordered', action='store_true',
+                        help="write results as they complete (batch mode)")
+    parser.add_argument('--time-limit', type=float, metavar='SEC',
+                        help="stop each search after SEC seconds (batch " +
+                        "mode), ARA* returns its best solution so far")
+    parser.add_argument('--tt-budget', type=int, default=64,
+                        metavar='MIB', help="memory for the " +
+                        "transposition table of IDA* (TT)")
+    parser.add_argument('--perimeter-depth', type=int, default=14,
+                        metavar='D', help="depth of the goal perimeter " +
+                        "of IDA* (perimeter)")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="don't look up or store solutions in " +
+                        "cache/solutions.jsonl")
+    parser.add_argument('--generate', type=int, metavar='N',
+                        help="write N random solvable boards (one per " +
+                        "line) to stdout")
+    parser.add_argument('--dim', type=parseDimension, default=(4, 4),
+                        metavar='WxH', help="dimension of generated boards")
+    parser.add_argument('--distance', type=parseRange, metavar='LOW-HIGH',
+                        help="generate boards with optimal solutions of " +
+                        "that length (up to 3x3)")
+    parser.add_argument('--walk', type=parseRange, metavar='LOW-HIGH',
+                        help="generate random walks of that many moves")
+    parser.add_argument('--band', type=parseRange, metavar='LOW-HIGH',
+                        help="generate boards rated in that band by the " +
+                        "heuristic (default: Manhattan Distance)")
+    parser.add_argument('--seed', type=int,
+                        help="seed for generated boards")
+    parser.add_argument('--benchmark', metavar='FILE', nargs='?', const='-',
+                        help="run the benchmark boards, write JSON lines " +
+                        "to FILE or stdout")
+    parser.add_argument('--korf', metavar='FILE',
+                        help="add the boards of FILE (format of Korf's " +
+                        "100 instances) to the benchmark")
+    parser.add_argument('--instances', metavar='TEXT', default='',
+                        help="only benchmark boards with TEXT in their name")
+    parser.add_argument('--time-budget', type=float, default=10,
+                        metavar='SEC', help="seconds per benchmark run")
+    parser.add_argument('--memory-budget', type=int, default=2048,
+                        metavar='MIB', help="memory per benchmark run")
+    parser.add_argument('--node-budget', type=int, metavar='N',
+                        help="expanded nodes per benchmark run")
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'),
+                        help="compare two benchmark results, exit with 1 " +
+                        "on regressions")
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help="relative change ignored by --compare")
+    return parser.parse_args()
+
+
+def main():
+    global puzzle, searches, curSearch, heuristics, curHeur, flag_cache
+    global tt_budget, perimeter_depth
+
+    args = parseArguments()
+    flag_cache = not args.no_cache
+    tt_budget = args.tt_budget
+    perimeter_depth = args.perimeter_depth
+
+    heuristics = makeHeuristics()
     curHeur = heuristics[0]
 
-    searches = [Search("BFS", Queue),
-                Search("A*", PriorityQueue),
-                Search("IDA*", None)]
+    searches = makeSearches()
     curSearch = searches[0]
 
-    keys = {
-        key.B:     ('b', "search BFS", lambda:
-                    puzzle.solve(puzzle.search(searches[0], curHeur,
-                                 _debug=flag_debug, _profile=flag_profile))),
-        key.A:     ('a', "search A*", lambda:
-                    puzzle.solve(puzzle.search(searches[1], curHeur,
-                                 _debug=flag_debug, _profile=flag_profile))),
-        key.I:     ('i', "search IDA*", lambda:
-                    puzzle.solve(puzzle.search(searches[2], curHeur,
-                                 _debug=flag_debug, _profile=flag_profile))),
-        key.SPACE: ('␣', "step through solution", lambda: puzzle.step()),
-        key.ENTER: ('↲', "reset puzzle", lambda: puzzle.reset()),
-        key.E:     ('e', "change heur", lambda: toggleHeuristic()),
-        key.H:     ('h', "toggle hint", lambda: toggleHint()),
-        key.R:     ('r', "random", lambda: puzzle.random(0, curHeur)),
-        key.T:     ('t', "random (limit)", lambda: puzzle.random(20, curHeur)),
-        key.Y:     ('y', "switch key directions", lambda: puzzle.twistmoves()),
-        key.X:     ('x', "toggle debug", lambda: toggleDebug()),
-        key.C:     ('c', "toggle profile", lambda: toggleProfile()),
-        key.P:     ('p', "print solution", lambda: puzzle.debugsolution()),
-        key.LEFT:  (None, "move left", lambda: puzzle.move(3)),
-        key.UP:    (None, "move up", lambda: puzzle.move(1)),
-        key.DOWN:  (None, "move down", lambda: puzzle.move(2)),
-        key.RIGHT: (None, "move right", lambda: puzzle.move(0))}
+    if args.compare is not None:
+        with open(args.compare[0]) as oldfile, \
+                open(args.compare[1]) as newfile:
+            regressions = compareResults(oldfile, newfile, args.tolerance)
+        sys.exit(1 if regressions else 0)
+
+    if args.benchmark is not None:
+        try:
+            searchNames = [obj.name for obj in searches]
+            if args.search is not None:
+                searchNames = [findByName(searches, args.search).name]
+            heuristicNames = [obj.name for obj in heuristics]
+            if args.heuristic is not None:
+                heuristicNames = [findByName(heuristics, args.heuristic).name]
+            instances = benchmarkBoards()
+            if args.korf is not None:
+                with open(args.korf) as infile:
+                    instances += readKorfBoards(infile)
+        except (ValueError, OSError) as e:
+            print(e, file=sys.stderr)
+            sys.exit(2)
+        instances = [instance for instance in instances
+                     if args.instances in instance[0]]
+
+        budgets = (args.time_budget, args.memory_budget, args.node_budget)
+        if args.benchmark == '-':
+            runBenchmark(sys.stdout, instances, searchNames, heuristicNames,
+                         budgets)
+        else:
+            with open(args.benchmark, 'w') as outfile:
+                runBenchmark(outfile, instances, searchNames,
+                             heuristicNames, budgets)
+        return None
+
+    if args.generate is not None:
+        try:
+            heuristicObject = findByName(heuristics,
+                                         args.heuristic or
+                                         "Manhattan Distance")
+            boards = generateBoards(args.dim, args.distance, args.walk,
+                                    args.band, heuristicObject,
+                                    random.Random(args.seed))
+            for i in range(args.generate):
+                print(','.join(str(tile) for tile in next(boards)))
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            sys.exit(2)
+        return None
+
+    if args.batch is not None:
+        try:
+            searchObject = findByName(searches,
+                                      args.search or "IDA* (in-place)")
+            heuristicObject = findByName(heuristics,
+                                         args.heuristic or
+                                         "Manhattan Distance")
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            sys.exit(2)
+
+        if args.batch == '-':
+            runBatch(sys.stdin, sys.stdout, searchObject, heuristicObject,
+                     args.jobs, not args.unordered, args.time_limit)
+        else:
+            with open(args.batch) as infile:
+                runBatch(infile, sys.stdout, searchObject, heuristicObject,
+                         args.jobs, not args.unordered, args.time_limit)
+        return None
+
+    if args.board is None:
+        puzzle = Puzzle(4, 4)
+    else:
+        try:
+            board, dim = parseBoard(args.board)
+        except ValueError as e:
+            print(e)
+            sys.exit(0)
+        puzzle = Puzzle(*dim)
+        puzzle.update(board)
 
+    initGUI()
     pyglet.app.run()
 
 if __name__ == '__main__':